@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+ALBUM_LATENCY = 0.6  # сек тишины, после которых альбом считается полученным
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Склеивает сообщения одного media_group_id в один вызов хендлера.
+    Первое сообщение альбома ждёт, пока остальные перестанут поступать,
+    и передаёт их все в data["album"]; остальные сообщения хендлер не вызывают.
+    Для одиночных сообщений album = [message].
+    """
+
+    def __init__(self, latency: float = ALBUM_LATENCY):
+        self.latency = latency
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not event.media_group_id:
+            data["album"] = [event]
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(event)
+            return None
+
+        album = self._albums[key] = [event]
+        try:
+            while True:
+                received = len(album)
+                await asyncio.sleep(self.latency)
+                if len(album) == received:
+                    break
+        finally:
+            del self._albums[key]
+
+        album.sort(key=lambda m: m.message_id)
+        data["album"] = album
+        return await handler(album[0], data)
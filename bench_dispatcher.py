@@ -0,0 +1,377 @@
+"""
+Нагрузочный бенчмарк диспетчера без Telegram.
+
+    python bench_dispatcher.py --users 50 --concurrency 10 --seed 200
+    python bench_dispatcher.py --save baseline.json
+    python bench_dispatcher.py --compare baseline.json
+
+Синтетические апдейты подаются в dp.feed_update, а вместо HTTP‑сессии бота
+стоит RecordingSession: она записывает вызовы Bot API и возвращает заглушки.
+По умолчанию используется файл SQLite (пересоздаётся при каждом запуске);
+для Postgres задайте DATABASE_URL и флаг --reset (таблицы будут пересозданы!).
+
+Сценарии идут фазами, внутри фазы виртуальные пользователи работают параллельно
+(не более --concurrency), апдейты одного пользователя — последовательно:
+start, wizard (мастер AddProperty целиком), my_objects, admin_list, edit, delete.
+По каждой фазе: апдейтов/сек, p50/p99 задержки, SQL‑запросов и вызовов API на апдейт.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+BENCH_DB = "bench_dispatcher.db"
+ADMIN_ID = 1
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{BENCH_DB}")
+os.environ.setdefault("ADMIN_IDS", str(ADMIN_ID))
+os.environ.pop("METRICS_PORT", None)
+# синтетические пользователи шлют апдейты быстрее людей — лимиты throttle_middleware исказили бы замер
+os.environ.setdefault("THROTTLE_ENABLED", "0")
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+from sqlalchemy import event, insert, select  # noqa: E402
+
+import bot as app  # noqa: E402
+from database import AsyncSessionLocal, engine, init_db  # noqa: E402
+from db_base import Base  # noqa: E402
+from models import Property, PropertyStatus, User, UserRole  # noqa: E402
+
+PHASES = ["start", "wizard", "my_objects", "admin_list", "edit", "delete"]
+
+
+# ---------- COUNTERS ----------
+class UpdateCost:
+    __slots__ = ("queries", "api_calls")
+
+    def __init__(self):
+        self.queries = 0
+        self.api_calls = 0
+
+
+# как и query_stats в db_middleware: contextvar доходит до greenlet драйвера,
+# поэтому запросы и вызовы API считаются по апдейту даже при параллельной обработке
+update_cost: ContextVar[Optional[UpdateCost]] = ContextVar("update_cost", default=None)
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    cost = update_cost.get()
+    if cost is not None:
+        cost.queries += 1
+
+
+# ---------- FAKE BOT SESSION ----------
+_MESSAGE_RESULTS = {"SendMessage", "SendPhoto", "SendVideo", "EditMessageText", "EditMessageMedia",
+                    "EditMessageCaption", "EditMessageReplyMarkup", "CopyMessage"}
+
+
+class RecordingSession(BaseSession):
+    """Сессия бота без сети: считает вызовы по методам и возвращает правдоподобные ответы"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Counter = Counter()
+        self._message_id = 0
+
+    def _message(self, bot, method) -> Message:
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", None)
+        return Message(
+            message_id=self._message_id, date=datetime.now(),
+            chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+            text=getattr(method, "text", None),
+        ).as_(bot)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        cost = update_cost.get()
+        if cost is not None:
+            cost.api_calls += 1
+        if name == "SendMediaGroup":
+            return [self._message(bot, method) for _ in method.media]
+        if name in _MESSAGE_RESULTS:
+            return self._message(bot, method)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+# ---------- UPDATES ----------
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+
+    def _user(self, tg_id: int) -> Dict[str, Any]:
+        return {"id": tg_id, "is_bot": False, "first_name": f"u{tg_id}"}
+
+    def _message(self, tg_id: int, **content) -> Dict[str, Any]:
+        return {"message_id": self.update_id, "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"}, "from": self._user(tg_id), **content}
+
+    def _build(self, **payload) -> Update:
+        self.update_id += 1
+        return Update.model_validate({"update_id": self.update_id, **payload}, context={"bot": self.bot})
+
+    def text(self, tg_id: int, text: str) -> Update:
+        return self._build(message=self._message(tg_id, text=text))
+
+    def photo(self, tg_id: int) -> Update:
+        file_id = f"bench_photo_{tg_id}_{self.update_id}"
+        return self._build(message=self._message(tg_id, photo=[
+            {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]))
+
+    def callback(self, tg_id: int, data: str) -> Update:
+        message = {**self._message(tg_id, text="…"), "from": {"id": 0, "is_bot": True, "first_name": "bot"}}
+        return self._build(callback_query={"id": str(self.update_id), "from": self._user(tg_id),
+                                           "chat_instance": str(tg_id), "data": data, "message": message})
+
+
+# ---------- RUNNER ----------
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.queries = 0
+        self.api_calls = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def report(self) -> Dict[str, float]:
+        count = len(self.latencies)
+        ordered = sorted(self.latencies)
+        return {
+            "updates": count,
+            "updates_per_sec": round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(statistics.median(ordered) * 1000, 2) if ordered else 0.0,
+            "p99_ms": round(ordered[min(count - 1, int(count * 0.99))] * 1000, 2) if ordered else 0.0,
+            "queries_per_update": round(self.queries / count, 2) if count else 0.0,
+            "api_calls_per_update": round(self.api_calls / count, 2) if count else 0.0,
+            "errors": self.errors,
+        }
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.updates = UpdateFactory(app.bot)
+        self.users = [args.id_base + i for i in range(args.users)]
+        self.created: Dict[int, List[int]] = {}
+
+    async def feed(self, phase: Phase, update: Update):
+        cost = UpdateCost()
+        token = update_cost.set(cost)
+        started = time.perf_counter()
+        try:
+            await app.dp.feed_update(app.bot, update)
+        except Exception:
+            phase.errors += 1
+            logging.exception("Апдейт %s упал", update.update_id)
+        finally:
+            phase.latencies.append(time.perf_counter() - started)
+            update_cost.reset(token)
+            phase.queries += cost.queries
+            phase.api_calls += cost.api_calls
+
+    async def run_phase(self, name: str, actors: List[int]) -> Phase:
+        phase = Phase(name)
+        script = getattr(self, f"script_{name}")
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def actor(tg_id: int):
+            async with semaphore:
+                for update in script(tg_id):
+                    await self.feed(phase, update)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(actor(tg_id) for tg_id in actors))
+        phase.elapsed = time.perf_counter() - started
+        return phase
+
+    # --- сценарии: генераторы апдейтов одного пользователя ---
+    def script_start(self, tg_id):
+        yield self.updates.text(tg_id, "/start")
+
+    def script_wizard(self, tg_id):
+        u = self.updates
+        yield u.text(tg_id, "/add_object")
+        yield u.text(tg_id, f"Юнусабад, квартал {tg_id % 19}")
+        for _ in range(self.args.photos):
+            yield u.photo(tg_id)
+        yield u.callback(tg_id, "finish_media")
+        yield u.text(tg_id, "3 / 5 / 9")
+        yield u.text(tg_id, "Евроремонт")
+        yield u.text(tg_id, "Подземный")
+        yield u.text(tg_id, "2")
+        yield u.text(tg_id, "Мебель, техника")
+        yield u.text(tg_id, str(90000 + tg_id % 1000))
+        yield u.callback(tg_id, "save_object")
+
+    def script_my_objects(self, tg_id):
+        u = self.updates
+        yield u.text(tg_id, "/my_objects")
+        yield u.callback(tg_id, "my_objects")
+        for property_id in self.created.get(tg_id, [])[:2]:
+            yield u.callback(tg_id, f"open_property_{property_id}")
+
+    def script_admin_list(self, tg_id):
+        # по паре запросов админа на каждого пользователя, чтобы фаза набрала объём
+        yield self.updates.callback(ADMIN_ID, "admin_properties")
+        yield self.updates.callback(ADMIN_ID, "admin_users")
+
+    def script_edit(self, tg_id):
+        u = self.updates
+        for property_id in self.created.get(tg_id, [])[:1]:
+            yield u.callback(tg_id, f"edit_property_{property_id}")
+            yield u.callback(tg_id, "edit_field_price")
+            yield u.text(tg_id, str(95000 + tg_id % 1000))
+            yield u.callback(tg_id, "edit_field_location")
+            yield u.text(tg_id, "Чиланзар")
+            yield u.callback(tg_id, "finish_edit")
+
+    def script_delete(self, tg_id):
+        # админ удаляет объект, созданный мастером для этого пользователя
+        for property_id in self.created.get(tg_id, [])[:1]:
+            yield self.updates.callback(ADMIN_ID, f"delete_property_{property_id}")
+
+    # --- данные ---
+    async def seed(self):
+        """
+        Фоновые объекты: args.seed на пользователя, чтобы списки и индексы работали на объёме.
+        Запускается после фазы start; владельцы, которых она не зарегистрировала (фазу
+        пропустили), создаются здесь — в Postgres created_by ссылается на users (FK).
+        """
+        if not self.args.seed:
+            return
+        async with AsyncSessionLocal() as session:
+            known = set((await session.execute(select(User.tg_id).where(User.tg_id.in_(self.users)))).scalars())
+            missing = [tg_id for tg_id in self.users if tg_id not in known]
+            if missing:
+                await session.execute(insert(User), [{"tg_id": tg_id, "role": UserRole.user} for tg_id in missing])
+                await session.commit()
+        now = datetime.utcnow()
+        rows = [
+            dict(title=f"seed {tg_id}/{i}", description="2 / 3 / 5", location=f"Сеед {i % 40}",
+                 condition="Хорошее", parking="Нет", bathrooms=1 + i % 3, additions="—",
+                 price=50000 + i, status=PropertyStatus.available, created_by=tg_id,
+                 created_at=now - timedelta(minutes=i))
+            for tg_id in self.users for i in range(self.args.seed)
+        ]
+        async with AsyncSessionLocal() as session:
+            for start in range(0, len(rows), 1000):
+                await session.execute(insert(Property), rows[start:start + 1000])
+            await session.commit()
+
+    async def load_created(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Property.created_by, Property.id)
+                .where(Property.created_by.in_(self.users), Property.title.not_like("seed %"))
+                .order_by(Property.id.desc())
+            )
+        self.created = {}
+        for created_by, property_id in result:
+            self.created.setdefault(created_by, []).append(property_id)
+
+    async def run(self) -> Dict[str, Dict[str, float]]:
+        if "start" not in self.args.phases:
+            await self.seed()
+        results = {}
+        for name in self.args.phases:
+            actors = [ADMIN_ID, *self.users] if name == "start" else self.users
+            if name in ("my_objects", "edit", "delete"):
+                await self.load_created()
+            phase = await self.run_phase(name, actors)
+            results[name] = phase.report()
+            print_row(name, results[name])
+            if name == "start":
+                # фон — после регистрации, чтобы фаза start мерила именно первый /start
+                await self.seed()
+        return results
+
+
+# ---------- REPORT ----------
+COLUMNS = ["updates", "updates_per_sec", "p50_ms", "p99_ms", "queries_per_update", "api_calls_per_update", "errors"]
+
+
+def print_row(name: str, row: Dict[str, float], baseline: Optional[Dict[str, float]] = None):
+    cells = []
+    for column in COLUMNS:
+        cell = f"{row[column]:>10}"
+        if baseline and column in baseline and baseline[column]:
+            cell += f" ({(row[column] - baseline[column]) / baseline[column] * 100:+.0f}%)"
+        cells.append(cell)
+    print(f"{name:<12}" + " ".join(cells))
+
+
+async def prepare_db(reset: bool):
+    if reset:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+
+
+async def main(args):
+    logging.basicConfig(level=logging.WARNING, force=True)
+    engine.sync_engine.echo = False  # echo в database.py включён при __debug__ и исказил бы замеры
+
+    if args.reset is None:
+        args.reset = engine.url.get_backend_name() == "sqlite"
+    await prepare_db(args.reset)
+
+    session = RecordingSession()
+    if args.scheduler:
+        session.middleware = app.bot.session.middleware  # те же лимиты отправки, что и в бою
+    app.bot.session = session
+
+    print(f"{'phase':<12}" + " ".join(f"{c:>10}" for c in COLUMNS))
+    results = await Bench(args).run()
+    await app.storage.close()
+    print("API calls:", dict(session.calls.most_common()))
+
+    meta = {"users": args.users, "concurrency": args.concurrency, "seed": args.seed,
+            "photos": args.photos, "database": engine.url.get_backend_name()}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta") != meta:
+            print("⚠ Параметры baseline отличаются:", baseline.get("meta"))
+        print("\nСравнение с", args.compare)
+        for name, row in results.items():
+            print_row(name, row, baseline["results"].get(name))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+        print("Baseline сохранён в", args.save)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="виртуальных пользователей")
+    parser.add_argument("--concurrency", type=int, default=10, help="одновременно активных пользователей")
+    parser.add_argument("--seed", type=int, default=100, help="фоновых объектов на пользователя")
+    parser.add_argument("--photos", type=int, default=3, help="фото в мастере добавления")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    parser.add_argument("--id-base", type=int, default=900_000_000, help="первый tg_id виртуальных пользователей")
+    parser.add_argument("--reset", action=argparse.BooleanOptionalAction, default=None,
+                        help="пересоздать таблицы (по умолчанию только для SQLite)")
+    parser.add_argument("--scheduler", action="store_true", help="пропускать вызовы через SendScheduler")
+    parser.add_argument("--save", metavar="FILE", help="сохранить результаты как baseline")
+    parser.add_argument("--compare", metavar="FILE", help="сравнить с сохранённым baseline")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""
+Микробенчмарк рендеринга страницы списка объектов.
+
+    python bench_render.py
+
+Сравнивает прежний f-string без экранирования, render.py без кэша (первый показ)
+и render.py с кэшем по (id, version) (повторный показ той же страницы).
+Базе данных и токен бота не нужны (DATABASE_URL может быть любым sqlite-URL).
+"""
+import os
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+import render  # noqa: E402
+from models import Property, PropertyStatus  # noqa: E402
+from pagination import PAGE_SIZE  # noqa: E402
+
+PAGES = 500
+
+
+def make_properties(count: int):
+    return [
+        Property(
+            id=i, version=1, created_by=1000 + i % 50, status=PropertyStatus.available,
+            location=f"Центр_{i % 30}, ул. *Navoi* {i}", description="3 комн / 5 / 9",
+            condition="Евроремонт", parking="Подземный", bathrooms=2,
+            additions="мебель, техника", price=Decimal(100000 + i), created_at=datetime.utcnow(),
+        )
+        for i in range(count)
+    ]
+
+
+def naive_page(props):
+    lines = ["🏠 *Ваши объекты:*"]
+    for prop in props:
+        lines.append(f"• *#{prop.id}* 📍 {prop.location} — 💰 {prop.price}")
+    return "\n".join(lines)
+
+
+def main():
+    props = make_properties(PAGE_SIZE * PAGES)
+    pages = [props[i:i + PAGE_SIZE] for i in range(0, len(props), PAGE_SIZE)]
+
+    def cold():
+        render.clear_cache()
+        for page in pages:
+            render.render_page("🏠 *Ваши объекты:*", page)
+
+    def warm():
+        for page in pages:
+            render.render_page("🏠 *Ваши объекты:*", page)
+
+    def naive():
+        for page in pages:
+            naive_page(page)
+
+    warm()  # прогрев кэша
+    for name, fn in (("f-string (без экранирования)", naive), ("render, холодный кэш", cold), ("render, тёплый кэш", warm)):
+        best = min(timeit.repeat(fn, number=5, repeat=5)) / 5
+        print(f"{name:30} {best / PAGES * 1e6:8.2f} мкс на страницу из {PAGE_SIZE}")
+    print("Кэш:", render.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Замер /search на синтетической таблице.
+
+    DATABASE_URL=postgresql+asyncpg://... python bench_search.py --rows 1000000
+
+Заполняет properties синтетическими объектами (INSERT ... SELECT generate_series,
+только PostgreSQL), выполняет ANALYZE и печатает время типовых запросов поиска.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import select, text
+
+from database import AsyncSessionLocal, engine, init_db
+from models import User
+from pagination import fetch_page
+from search_handler import build_filters
+
+BENCH_USER = 1
+
+SEED_SQL = """
+INSERT INTO properties (title, description, location, condition, parking, bathrooms, additions,
+                        price, status, created_by, created_at)
+SELECT 'Объект ' || g,
+       (1 + g % 5) || ' комн / ' || (1 + g % 20) || ' / 20',
+       (ARRAY['Центр', 'Чиланзар', 'Юнусабад', 'Мирабад', 'Сергели', 'Яккасарай'])[1 + g % 6] || ', дом ' || g % 300,
+       'Евроремонт',
+       (ARRAY['Подземный', 'Наземный', 'Нет'])[1 + g % 3],
+       1 + g % 4,
+       '',
+       20000 + (g * 7919) % 480000,
+       (ARRAY['available', 'available', 'available', 'sold', 'price_changed', 'removed'])[1 + g % 6]::propertystatus,
+       :user,
+       now() - (g || ' minutes')::interval
+FROM generate_series(1, :rows) AS g
+"""
+
+CASES = {
+    "цена 100–150k": {"price_min": "100000", "price_max": "150000"},
+    "в продаже, 2+ санузла": {"status": "available", "bathrooms": 2},
+    "локация «Юнус»": {"location": "Юнус"},
+    "всё вместе": {"price_min": "50000", "price_max": "300000", "status": "available",
+                   "bathrooms": 2, "parking": "Подземный", "location": "Центр"},
+}
+
+
+async def seed(rows: int):
+    async with AsyncSessionLocal() as session:
+        if not (await session.execute(select(User.id).where(User.tg_id == BENCH_USER))).scalar():
+            session.add(User(tg_id=BENCH_USER, name="bench"))
+            await session.flush()
+        existing = (await session.execute(text("SELECT count(*) FROM properties"))).scalar()
+        if existing < rows:
+            await session.execute(text(SEED_SQL), {"rows": rows - existing, "user": BENCH_USER})
+        await session.commit()
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE properties"))
+
+
+async def bench(repeats: int):
+    async with AsyncSessionLocal() as session:
+        for name, filters in CASES.items():
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                page = await fetch_page(session, *build_filters(filters))
+                if page.has_next:
+                    await fetch_page(session, *build_filters(filters), cursor=page.last_cursor)
+                timings.append((time.perf_counter() - started) * 1000 / (2 if page.has_next else 1))
+            print(f"{name:28} p50={statistics.median(timings):6.2f} мс  max={max(timings):6.2f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    await init_db()
+    await seed(args.rows)
+    await bench(args.repeats)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,29 +1,74 @@
 import asyncio
+from decimal import Decimal
 from functools import wraps
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.enums import ParseMode
+from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from sqlalchemy import select, delete
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from sqlalchemy import case, literal, select, delete, update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
 
-from config import BOT_TOKEN, ADMIN_IDS, CHANNEL_USERNAME
-from database import AsyncSessionLocal, init_db
-from models import User, UserRole, Property, PropertyStatus
+from config import BOT_TOKEN, ADMIN_IDS, BOT_MODE
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine, init_db
+from models import User, UserRole, Property, PropertyStatus, ChannelOutbox
+from outbox import OutboxWorker, schedule_channel_delete, schedule_channel_edit, schedule_channel_edits
+from fsm_storage import SQLStorage, FSMFlushMiddleware
+from db_middleware import DbSessionMiddleware, read_only, setup_replica_routing
+from throttle_middleware import setup_throttling
+from media import add_media, media_from_message
+from album_middleware import AlbumMiddleware
+from counters import load_dashboard, render_dashboard
+from market_stats import load_market_stats, render_market_stats
+from saved_searches import schedule_notify
+from render import escape_md, property_actions, render_card, render_page, render_preview
+from search_handler import router as search_router
+from bulk_handler import router as bulk_router
+from inline_handler import inline_cache, router as inline_router
+from pagination import Page, fetch_page, page_keyboard
+from user_cache import get_user_info, invalidate_user, is_admin, remember_user, change_user_role, user_cache
+from send_scheduler import SendScheduler
+from metrics import setup_metrics, start_metrics_server
+import render
 from states import AddProperty, EditProperty
 
 logging.basicConfig(level=logging.INFO)
-dp = Dispatcher(storage=MemoryStorage())
+storage = SQLStorage()
+dp = Dispatcher(storage=storage)
+# первым из наших outer‑middleware: лишние апдейты отбрасываются до FSMFlushMiddleware и
+# до открытия сессии БД (встроенный FSMContextMiddleware aiogram всё равно срабатывает раньше)
+throttle = setup_throttling(dp)
+dp.update.outer_middleware(FSMFlushMiddleware(storage))
+dp.update.middleware(DbSessionMiddleware())
+# хендлеры с @read_only читают с реплики; без REPLICA_DATABASE_URL — None
+replica_routing = setup_replica_routing(dp)
+dp.message.middleware(AlbumMiddleware())
+dp.include_router(search_router)
+dp.include_router(bulk_router)
+dp.include_router(inline_router)
 bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.MARKDOWN)
+send_scheduler = SendScheduler()
+bot.session.middleware(send_scheduler)
+outbox_worker = OutboxWorker(bot)
+# после SendScheduler, чтобы время API не включало ожидание лимитов; без METRICS_PORT — no-op
+setup_metrics(dp, bot, engine, stats={
+    "send_scheduler": send_scheduler.stats,
+    "user_cache": user_cache.stats,
+    "inline_cache": inline_cache.stats,
+    "render_cache": lambda: render.stats,
+    **({"throttle": throttle.stats} if throttle else {}),
+    **({"replica": replica_routing.stats} if replica_routing else {}),
+})
+metrics_runner = None
 
 # ---------- DECORATOR ----------
 def admin_only(handler):
     @wraps(handler)
     async def wrapper(event, *args, **kwargs):
         tg_id = event.from_user.id
-        if tg_id not in ADMIN_IDS:
+        if not await is_admin(tg_id):
             if isinstance(event, types.CallbackQuery):
                 await event.answer("🚫 Недостаточно прав.", show_alert=True)
             else:
@@ -35,44 +80,43 @@ def admin_only(handler):
 # ---------- MENUS ----------
 def admin_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
         [InlineKeyboardButton(text="📋 Список пользователей", callback_data="admin_users")],
         [InlineKeyboardButton(text="🏠 Все объекты", callback_data="admin_properties")],
         [InlineKeyboardButton(text="📄 Добавить объект", callback_data="admin_add")],
         [InlineKeyboardButton(text="🔙 Назад в меню", callback_data="admin_back")]
     ])
 
-def property_actions(property_id: int, is_admin: bool = False) -> InlineKeyboardMarkup:
-    buttons = [[InlineKeyboardButton(text="✏ Редактировать", callback_data=f"edit_property_{property_id}")]]
-    if is_admin:
-        buttons.append([InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_property_{property_id}")])
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="my_objects" if not is_admin else "admin_properties")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
 # ---------- /START ----------
-@dp.message(F.text == "/start")
-async def cmd_start(message: types.Message):
+# CommandStart, а не F.text: кнопка inline‑режима присылает «/start inline» (deep link)
+@dp.message(CommandStart())
+async def cmd_start(message: types.Message, session: AsyncSession):
     tg_id = message.from_user.id
-    async with AsyncSessionLocal() as session:
-        user = (await session.execute(select(User).where(User.tg_id == tg_id))).scalar_one_or_none()
-
-        if not user:
-            role = UserRole.admin if tg_id in ADMIN_IDS else UserRole.user
-            session.add(User(tg_id=tg_id, role=role))
-            try:
-                await session.commit()
-            except IntegrityError:
-                await session.rollback()
-
-            await message.answer(f"👋 Привет! Ты зарегистрирован как *{role.value}*.\n"
-                                "Используй /add_object для добавления объекта или /my_objects для просмотра своих объектов.",
-                                parse_mode="Markdown")
-        else:
-            await message.answer("👋 С возвращением!\n"
-                                "Используй /add_object для добавления объекта или /my_objects для просмотра своих объектов.",
-                                parse_mode="Markdown")
+    info = await get_user_info(tg_id)
+
+    if not info.exists:
+        role = UserRole.admin if tg_id in ADMIN_IDS else UserRole.user
+        session.add(User(tg_id=tg_id, role=role))
+        try:
+            await session.commit()
+            remember_user(tg_id, role)
+        except IntegrityError:
+            # параллельный /start уже создал пользователя: сбрасываем отрицательный ответ кэша
+            await session.rollback()
+            invalidate_user(tg_id)
+            role = (await get_user_info(tg_id)).role or role
+
+        await message.answer(f"👋 Привет! Ты зарегистрирован как *{role.value}*.\n"
+                            "Используй /add_object для добавления объекта или /my_objects для просмотра своих объектов.",
+                            parse_mode="Markdown")
+    else:
+        role = info.role
+        await message.answer("👋 С возвращением!\n"
+                            "Используй /add_object для добавления объекта или /my_objects для просмотра своих объектов.",
+                            parse_mode="Markdown")
 
-        if tg_id in ADMIN_IDS:
-            await message.answer("🛠 Админ-меню", reply_markup=admin_menu())
+    if role == UserRole.admin:
+        await message.answer("🛠 Админ-меню", reply_markup=admin_menu())
 
 # ---------- ADMIN MENU ----------
 @dp.message(F.text == "/menu")
@@ -86,76 +130,296 @@ async def callback_menu(callback: types.CallbackQuery):
     await callback.answer()
     await callback.message.edit_text("🛠 Админ-меню", reply_markup=admin_menu())
 
+@dp.message(F.text.startswith("/set_role"))
+@admin_only
+async def set_role(message: types.Message):
+    try:
+        _, tg_id, role = message.text.split()
+        tg_id, role = int(tg_id), UserRole[role]
+    except (ValueError, KeyError):
+        await message.answer("❌ Формат: /set_role <tg_id> <admin|user>")
+        return
+    if await change_user_role(tg_id, role):
+        await message.answer(f"✅ Роль пользователя `{tg_id}` изменена на *{role.value}*.", parse_mode="Markdown")
+    else:
+        await message.answer("❌ Пользователь не найден.")
+
+# ---------- DASHBOARD ----------
+@dp.callback_query(F.data == "admin_stats")
+@admin_only
+@read_only
+async def callback_stats(callback: types.CallbackQuery, session: AsyncSession):
+    text = render_dashboard(await load_dashboard(session))
+    await callback.answer()
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=admin_menu())
+
+# ---------- MARKET STATS ----------
+@dp.message(F.text.startswith("/stats"))
+@read_only
+async def market_stats_command(message: types.Message, session: AsyncSession):
+    location = message.text.partition(" ")[2].strip()
+    if not location:
+        await message.answer("📈 Формат: /stats <локация>, например /stats Юнусабад")
+        return
+    text = render_market_stats(await load_market_stats(session, location))
+    await message.answer(text, parse_mode="Markdown")
+
 # ---------- USER LIST ----------
+USERS_PAGE_SIZE = 20
+
+async def load_users_page(session: AsyncSession, after_id: int = 0, direction: str = "next"):
+    """Keyset по users.id: (пользователи, есть ли предыдущая, есть ли следующая страница)"""
+    stmt = select(User)
+    if direction == "prev":
+        stmt = stmt.where(User.id < after_id).order_by(User.id.desc())
+    else:
+        stmt = stmt.where(User.id > after_id).order_by(User.id.asc())
+    users = list((await session.execute(stmt.limit(USERS_PAGE_SIZE + 1))).scalars().all())
+    has_more = len(users) > USERS_PAGE_SIZE
+    users = users[:USERS_PAGE_SIZE]
+    if direction == "prev":
+        users.reverse()
+        return users, has_more, True
+    return users, after_id > 0, has_more
+
+async def show_users_page(callback: types.CallbackQuery, session: AsyncSession, after_id: int = 0, direction: str = "next"):
+    users, has_prev, has_next = await load_users_page(session, after_id, direction)
+    await callback.answer()
+    if not users:
+        await callback.message.edit_text("🙁 Нет пользователей.", reply_markup=admin_menu())
+        return
+
+    text = "📋 *Пользователи:*\n" + "\n".join(f"• `{u.tg_id}` – {u.role.value}" for u in users)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀", callback_data=f"users_page_prev_{users[0].id}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶", callback_data=f"users_page_next_{users[-1].id}"))
+    buttons = [nav] if nav else []
+    buttons.append([InlineKeyboardButton(text="🔙 Назад в меню", callback_data="admin_back")])
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
 @dp.callback_query(F.data == "admin_users")
 @admin_only
-async def callback_users(callback: types.CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        users = (await session.execute(select(User))).scalars().all()
-
-    text = "🙁 Нет пользователей." if not users else \
-        "📋 *Пользователи:*\n" + "\n".join(f"• `{u.tg_id}` – {u.role.value}" for u in users)
+@read_only
+async def callback_users(callback: types.CallbackQuery, session: AsyncSession):
+    await show_users_page(callback, session)
 
+@dp.callback_query(F.data.startswith("users_page_"))
+@admin_only
+@read_only
+async def page_users(callback: types.CallbackQuery, session: AsyncSession):
+    _, _, direction, after_id = callback.data.split("_", 3)
+    await show_users_page(callback, session, int(after_id), direction)
+
+# ---------- PROPERTY LIST ----------
+def properties_page_text(page: Page, title: str, show_creator: bool = False) -> str:
+    return render_page(title, page.items, "line_admin" if show_creator else "line")
+
+PAGE_TITLES = {"all": "🏠 *Все объекты:*", "my": "🏠 *Ваши объекты:*", "archive": "🗄 *Архив (продано/снято):*"}
+EMPTY_TEXTS = {
+    "all": "🙁 Нет объектов.",
+    "my": "🙁 У вас нет объектов. Добавьте новый с помощью /add_object.",
+    "archive": "🙁 В архиве пусто.",
+}
+
+def properties_page_keyboard(page: Page, scope: str) -> InlineKeyboardMarkup:
+    if scope == "all":
+        extra = [[InlineKeyboardButton(text="🔙 Назад в меню", callback_data="admin_back")]]
+    elif scope == "my":
+        extra = [[InlineKeyboardButton(text="🗄 Архив", callback_data="my_archive")]]
+    else:
+        extra = [[InlineKeyboardButton(text="🔙 К объектам", callback_data="my_objects")]]
+    return page_keyboard(page, "open_property_", f"page_{scope}_", extra)
+
+async def load_properties_page(session: AsyncSession, tg_id: int, scope: str, cursor: str = "", direction: str = "next") -> Page:
+    # проданные и снятые объекты — только в архиве; остальные списки идут по частичным индексам
+    filters = [Property.active(scope != "archive")]
+    if scope != "all":
+        filters.append(Property.created_by == tg_id)
+    return await fetch_page(session, *filters, cursor=cursor, direction=direction)
+
+async def show_properties_page(callback: types.CallbackQuery, session: AsyncSession, scope: str,
+                               cursor: str = "", direction: str = "next"):
+    page = await load_properties_page(session, callback.from_user.id, scope, cursor, direction)
     await callback.answer()
-    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=admin_menu())
+    if not page.items and not page.has_prev:
+        await callback.message.edit_text(EMPTY_TEXTS[scope], reply_markup=admin_menu() if scope == "all" else
+                                         properties_page_keyboard(page, scope))
+        return
+    await callback.message.edit_text(properties_page_text(page, PAGE_TITLES[scope], show_creator=scope == "all"),
+                                     parse_mode="Markdown", reply_markup=properties_page_keyboard(page, scope))
 
 # ---------- PROPERTY LIST (USER) ----------
 @dp.message(F.text == "/my_objects")
-async def my_objects(message: types.Message):
-    tg_id = message.from_user.id
-    async with AsyncSessionLocal() as session:
-        properties = (await session.execute(select(Property).where(Property.created_by == tg_id))).scalars().all()
-
-    if not properties:
-        await message.answer("🙁 У вас нет объектов. Добавьте новый с помощью /add_object.")
+@read_only
+async def my_objects(message: types.Message, session: AsyncSession):
+    page = await load_properties_page(session, message.from_user.id, "my")
+    if not page.items:
+        await message.answer(EMPTY_TEXTS["my"], reply_markup=properties_page_keyboard(page, "my"))
         return
-
-    for prop in properties:
-        text = (
-            f"*Объект #{prop.id}*\n"
-            f"📍 {prop.location}\n"
-            f"🛏 {prop.description}\n"
-            f"🧱 {prop.condition}\n"
-            f"🚗 {prop.parking}\n"
-            f"🚽 {prop.bathrooms}\n"
-            f"✏ {prop.additions}\n"
-            f"💰 *{prop.price}*"
-        )
-        await message.answer(text, parse_mode="Markdown", reply_markup=property_actions(prop.id))
+    await message.answer(properties_page_text(page, PAGE_TITLES["my"]), parse_mode="Markdown",
+                         reply_markup=properties_page_keyboard(page, "my"))
+
+@dp.callback_query(F.data == "my_objects")
+@read_only
+async def callback_my_objects(callback: types.CallbackQuery, session: AsyncSession):
+    await show_properties_page(callback, session, "my")
+
+@dp.callback_query(F.data.startswith("page_my_"))
+@read_only
+async def page_my_objects(callback: types.CallbackQuery, session: AsyncSession):
+    _, _, direction, cursor = callback.data.split("_", 3)
+    await show_properties_page(callback, session, "my", cursor, direction)
+
+@dp.callback_query(F.data == "my_archive")
+@read_only
+async def callback_my_archive(callback: types.CallbackQuery, session: AsyncSession):
+    await show_properties_page(callback, session, "archive")
+
+@dp.callback_query(F.data.startswith("page_archive_"))
+@read_only
+async def page_my_archive(callback: types.CallbackQuery, session: AsyncSession):
+    _, _, direction, cursor = callback.data.split("_", 3)
+    await show_properties_page(callback, session, "archive", cursor, direction)
 
 # ---------- PROPERTY LIST (ADMIN) ----------
 @dp.callback_query(F.data == "admin_properties")
 @admin_only
-async def admin_properties(callback: types.CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        properties = (await session.execute(select(Property))).scalars().all()
+@read_only
+async def admin_properties(callback: types.CallbackQuery, session: AsyncSession):
+    await show_properties_page(callback, session, "all")
 
-    if not properties:
-        await callback.message.edit_text("🙁 Нет объектов.", reply_markup=admin_menu())
+@dp.callback_query(F.data.startswith("page_all_"))
+@admin_only
+@read_only
+async def page_admin_properties(callback: types.CallbackQuery, session: AsyncSession):
+    _, _, direction, cursor = callback.data.split("_", 3)
+    await show_properties_page(callback, session, "all", cursor, direction)
+
+# ---------- PROPERTY CARD ----------
+@dp.callback_query(F.data.startswith("open_property_"))
+@read_only
+async def open_property(callback: types.CallbackQuery, session: AsyncSession):
+    property_id = int(callback.data.split("_")[-1])
+    admin = await is_admin(callback.from_user.id)
+    prop = await session.get(Property, property_id)
+
+    await callback.answer()
+    if not prop:
+        await callback.message.edit_text("❌ Объект не найден.")
+        return
+    if prop.created_by != callback.from_user.id and not admin:
+        await callback.message.edit_text("🚫 Вы не можете просматривать этот объект.")
         return
 
-    for prop in properties:
-        text = (
-            f"*Объект #{prop.id}* (создал: `{prop.created_by}`)\n"
-            f"📍 {prop.location}\n"
-            f"🛏 {prop.description}\n"
-            f"🧱 {prop.condition}\n"
-            f"🚗 {prop.parking}\n"
-            f"🚽 {prop.bathrooms}\n"
-            f"✏ {prop.additions}\n"
-            f"💰 *{prop.price}*"
-        )
-        await callback.message.answer(text, parse_mode="Markdown", reply_markup=property_actions(prop.id, is_admin=True))
+    text = render_card(prop, "admin" if admin else "card")
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=property_actions(prop.id, is_admin=admin))
+
+# ---------- STATUS ----------
+BULK_STATUS_LIMIT = 1000
+
+async def update_status(session: AsyncSession, property_ids, status: PropertyStatus, owner: int = None) -> list:
+    """
+    Смена статуса одним UPDATE ... WHERE id IN (...) для любого числа объектов.
+    version растёт — карточки в кэше render.py и результатах поиска перерисуются;
+    опубликованные посты обновляются пачкой заданий outbox.
+    owner: менять только объекты этого агента. Возвращает id изменённых объектов.
+    """
+    stmt = update(Property).where(Property.id.in_(property_ids), Property.status != status)
+    if owner is not None:
+        stmt = stmt.where(Property.created_by == owner)
+    rows = (await session.execute(
+        stmt.values(status=status, version=Property.version + 1)
+        .returning(Property.id, Property.channel_message_id)
+        .execution_options(synchronize_session=False)
+    )).all()
+    await schedule_channel_edits(session, [property_id for property_id, message_id in rows if message_id])
+    return [property_id for property_id, _ in rows]
+
+def parse_ids(tokens) -> list:
+    """«12 15 20-30» -> [12, 15, 20, ..., 30]"""
+    ids = []
+    for token in tokens:
+        low, sep, high = token.partition("-")
+        ids.extend(range(int(low), int(high) + 1) if sep else [int(low)])
+    return ids
+
+def status_keyboard(property_id: int) -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(text=s.value, callback_data=f"status_set_{property_id}_{s.name}")] for s in PropertyStatus]
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=f"open_property_{property_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@dp.callback_query(F.data.startswith("status_menu_"))
+async def status_menu(callback: types.CallbackQuery, session: AsyncSession):
+    property_id = int(callback.data.split("_")[-1])
+    prop = await session.get(Property, property_id)
+    if not prop or (prop.created_by != callback.from_user.id and not await is_admin(callback.from_user.id)):
+        await callback.answer("🚫 Недостаточно прав.", show_alert=True)
+        return
     await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=status_keyboard(property_id))
+
+@dp.callback_query(F.data.startswith("status_set_"))
+async def status_set(callback: types.CallbackQuery, session: AsyncSession):
+    _, _, property_id, status = callback.data.split("_", 3)
+    owner = None if await is_admin(callback.from_user.id) else callback.from_user.id
+    changed = await update_status(session, [int(property_id)], PropertyStatus[status], owner)
+    await session.commit()
+    outbox_worker.notify()
+
+    # пустой UPDATE не отличает «уже в этом статусе» от «не ваш объект» — проверяем владельца
+    prop = await session.get(Property, int(property_id))
+    if not prop:
+        await callback.answer("❌ Объект не найден.", show_alert=True)
+        return
+    if owner is not None and prop.created_by != owner:
+        await callback.answer("🚫 Недостаточно прав.", show_alert=True)
+        return
+    await callback.answer(f"🏷 {PropertyStatus[status].value}" if changed else "Статус не изменился.")
+    await callback.message.edit_text(render_card(prop, "card" if owner else "admin"), parse_mode="Markdown",
+                                     reply_markup=property_actions(prop.id, is_admin=owner is None))
+
+@dp.message(F.text.startswith("/status"))
+async def status_command(message: types.Message, session: AsyncSession):
+    try:
+        _, property_id, status = message.text.split()
+        property_id, status = int(property_id), PropertyStatus[status]
+    except (ValueError, KeyError):
+        await message.answer("❌ Формат: /status <id> <" + "|".join(PropertyStatus.__members__) + ">")
+        return
+    owner = None if await is_admin(message.from_user.id) else message.from_user.id
+    changed = await update_status(session, [property_id], status, owner)
+    await session.commit()
+    outbox_worker.notify()
+    await message.answer(f"✅ Объект #{property_id}: {status.value}" if changed else
+                         "❌ Объект не найден, не ваш или уже в этом статусе.")
+
+@dp.message(F.text.startswith("/bulk_status"))
+@admin_only
+async def bulk_status(message: types.Message, session: AsyncSession):
+    try:
+        _, status, *tokens = message.text.split()
+        status, ids = PropertyStatus[status], parse_ids(tokens)
+    except (ValueError, KeyError):
+        ids = None
+    if not ids:
+        await message.answer("❌ Формат: /bulk_status <" + "|".join(PropertyStatus.__members__) + "> <id> <id> <от-до> ...")
+        return
+    if len(ids) > BULK_STATUS_LIMIT:
+        await message.answer(f"❌ Не больше {BULK_STATUS_LIMIT} объектов за раз.")
+        return
+    changed = await update_status(session, ids, status)
+    await session.commit()
+    outbox_worker.notify()
+    await message.answer(f"✅ Статус «{status.value}» установлен для {len(changed)} из {len(set(ids))} объектов.")
 
 # ---------- ADD OBJECT ----------
 @dp.message(F.text == "/add_object")
 async def start_add_property(message: types.Message, state: FSMContext):
-    async with AsyncSessionLocal() as session:
-        user = (await session.execute(select(User).where(User.tg_id == message.from_user.id))).scalar_one_or_none()
-        if not user:
-            await message.answer("🚫 Вы не зарегистрированы. Используй /start для регистрации.")
-            return
+    if not (await get_user_info(message.from_user.id)).exists:
+        await message.answer("🚫 Вы не зарегистрированы. Используй /start для регистрации.")
+        return
     await state.clear()
     await state.set_state(AddProperty.location)
     await message.answer("📍 Введите локацию:", reply_markup=ReplyKeyboardRemove())
@@ -170,13 +434,13 @@ async def step_location(message: types.Message, state: FSMContext):
     await message.answer("📸 Прикрепите фото/видео объекта и нажмите кнопку.", reply_markup=kb)
 
 @dp.message(AddProperty.media, F.photo | F.video)
-async def collect_media(message: types.Message, state: FSMContext):
+async def collect_media(message: types.Message, state: FSMContext, album: list[types.Message]):
     data = await state.get_data()
     media = data["media"]
-    file_id = message.photo[-1].file_id if message.photo else message.video.file_id
-    media.append(file_id)
+    added = [item for item in map(media_from_message, album) if item]
+    media.extend(added)
     await state.update_data(media=media)
-    await message.answer("✅ Медиа добавлено.")
+    await message.answer("✅ Медиа добавлено." if len(added) == 1 else f"✅ Добавлено медиа: {len(added)}.")
 
 @dp.callback_query(F.data == "finish_media")
 async def finish_media(callback: types.CallbackQuery, state: FSMContext):
@@ -184,6 +448,15 @@ async def finish_media(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(AddProperty.description)
     await callback.message.answer("🛏 Комнаты / этаж / этажность:", reply_markup=ReplyKeyboardRemove())
 
+def layout_values(text: str) -> dict:
+    """
+    Ответ на «Комнаты / этаж / этажность» (хранится в description) -> rooms, floor, total_floors.
+    Нужен для статистики по комнатам (/stats); нераспознанные части — None.
+    """
+    parts = [part.strip() for part in (text or "").split("/")] + ["", "", ""]
+    return {column: part if part.isdigit() else None
+            for column, part in zip(("rooms", "floor", "total_floors"), parts)}
+
 @dp.message(AddProperty.description)
 async def step_description(message: types.Message, state: FSMContext):
     await state.update_data(description=message.text)
@@ -224,16 +497,7 @@ async def step_price(message: types.Message, state: FSMContext):
         float(message.text)  # Валидация
         await state.update_data(price=message.text)
         data = await state.get_data()
-        preview = (
-            f"*Предпросмотр:*\n"
-            f"📍 {data['location']}\n"
-            f"🛏 {data['description']}\n"
-            f"🧱 {data['condition']}\n"
-            f"🚗 {data['parking']}\n"
-            f"🚽 {data['bathrooms']}\n"
-            f"✏ {data['additions']}\n"
-            f"💰 *{data['price']}*"
-        )
+        preview = render_preview(data)
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="✅ Сохранить", callback_data="save_object")],
             [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_object")]
@@ -244,53 +508,35 @@ async def step_price(message: types.Message, state: FSMContext):
         await message.answer("❌ Пожалуйста, введите цену в числах.")
 
 @dp.callback_query(F.data == "save_object")
-async def save_object(callback: types.CallbackQuery, state: FSMContext):
+async def save_object(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
-    async with AsyncSessionLocal() as session:
-        try:
-            prop = Property(
-                title=data["description"] or data["location"],
-                description=data["description"],
-                location=data["location"],
-                condition=data["condition"],
-                parking=data["parking"],
-                bathrooms=int(data["bathrooms"]),
-                additions=data["additions"],
-                price=data["price"],
-                media_group_id=",".join(data.get("media", [])),  # Сохраняем file_id медиа
-                created_by=callback.from_user.id
-            )
-            session.add(prop)
-            await session.commit()
-
-            # Публикация в канал
-            message_text = (
-                f"*Новый объект #{prop.id}*\n"
-                f"📍 {data['location']}\n"
-                f"🛏 {data['description']}\n"
-                f"🧱 {data['condition']}\n"
-                f"🚗 {data['parking']}\n"
-                f"🚽 {data['bathrooms']}\n"
-                f"✏ {data['additions']}\n"
-                f"💰 *{data['price']}*"
-            )
-            media = data.get("media", [])
-            if media:
-                from aiogram.types import InputMediaPhoto, InputMediaVideo
-                media_group = []
-                for file_id in media:
-                    media_group.append(InputMediaPhoto(media=file_id) if file_id.startswith("Ag") else InputMediaVideo(media=file_id))
-                await bot.send_media_group(chat_id=CHANNEL_USERNAME, media=media_group)
-                await bot.send_message(chat_id=CHANNEL_USERNAME, text=message_text, parse_mode="Markdown")
-            else:
-                await bot.send_message(chat_id=CHANNEL_USERNAME, text=message_text, parse_mode="Markdown")
-
-            await callback.message.edit_text(f"✅ Объект #{prop.id} успешно добавлен и опубликован в канале!")
-        except SQLAlchemyError as e:
-            await session.rollback()
-            await callback.message.edit_text(f"❌ Ошибка при сохранении: {str(e)}")
-        except Exception as e:
-            await callback.message.edit_text(f"❌ Ошибка при отправке в канал: {str(e)}")
+    try:
+        prop = Property(
+            title=data["description"] or data["location"],
+            description=data["description"],
+            **layout_values(data["description"]),
+            location=data["location"],
+            condition=data["condition"],
+            parking=data["parking"],
+            bathrooms=int(data["bathrooms"]),
+            additions=data["additions"],
+            price=data["price"],
+            created_by=callback.from_user.id
+        )
+        session.add(prop)
+        await session.flush()
+        await add_media(session, prop.id, data.get("media", []))
+
+        # Публикация в канал — через outbox в той же транзакции
+        session.add(ChannelOutbox(kind="publish", property_id=prop.id))
+        schedule_notify(session, prop.id)
+        await session.commit()
+        outbox_worker.notify()
+
+        await callback.message.edit_text(f"✅ Объект #{prop.id} успешно добавлен и будет опубликован в канале!")
+    except SQLAlchemyError as e:
+        await session.rollback()
+        await callback.message.edit_text(f"❌ Ошибка при сохранении: {str(e)}")
     await state.clear()
 
 @dp.callback_query(F.data == "cancel_object")
@@ -299,21 +545,22 @@ async def cancel_object(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("❌ Добавление объекта отменено.")
 
 # ---------- EDIT PROPERTY ----------
-@dp.callback_query(F.data.startswith("edit_property_"))
-async def start_edit_property(callback: types.CallbackQuery, state: FSMContext):
-    property_id = int(callback.data.split("_")[-1])
-    async with AsyncSessionLocal() as session:
-        prop = (await session.execute(select(Property).where(Property.id == property_id))).scalar_one_or_none()
-        if not prop:
-            await callback.message.edit_text("❌ Объект не найден.")
-            return
-        if prop.created_by != callback.from_user.id and callback.from_user.id not in ADMIN_IDS:
-            await callback.message.edit_text("🚫 Вы не можете редактировать этот объект.")
-            return
-
-    await state.update_data(property_id=property_id)
-    await state.set_state(EditProperty.field)
-    kb = InlineKeyboardMarkup(inline_keyboard=[
+# Правки копятся в FSM‑данных (changes, new_media) и применяются в finish_edit
+# одним UPDATE изменённых колонок с проверкой version: если объект успел изменить
+# кто‑то другой, пользователь видит конфликт, а не затирает чужие правки молча.
+EDIT_FIELD_NAMES = {
+    "location": "локацию",
+    "description": "описание",
+    "condition": "состояние",
+    "parking": "парковку",
+    "bathrooms": "количество санузлов",
+    "additions": "дополнения",
+    "price": "цену",
+    "media": "медиа (прикрепите новые файлы)"
+}
+
+def edit_menu() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📍 Локация", callback_data="edit_field_location")],
         [InlineKeyboardButton(text="🛏 Описание", callback_data="edit_field_description")],
         [InlineKeyboardButton(text="🧱 Состояние", callback_data="edit_field_condition")],
@@ -322,9 +569,60 @@ async def start_edit_property(callback: types.CallbackQuery, state: FSMContext):
         [InlineKeyboardButton(text="✏ Дополнения", callback_data="edit_field_additions")],
         [InlineKeyboardButton(text="💰 Цена", callback_data="edit_field_price")],
         [InlineKeyboardButton(text="📸 Медиа", callback_data="edit_field_media")],
-        [InlineKeyboardButton(text="✅ Завершить", callback_data="finish_edit")]
+        [InlineKeyboardButton(text="✅ Завершить", callback_data="finish_edit"),
+         InlineKeyboardButton(text="❌ Отменить", callback_data="edit_cancel")]
     ])
-    await callback.message.edit_text("✏ Выберите поле для редактирования:", reply_markup=kb)
+
+def edit_values(changes: dict) -> dict:
+    values = dict(changes)
+    if "bathrooms" in values:
+        values["bathrooms"] = int(values["bathrooms"])
+    if "price" in values:
+        values["price"] = Decimal(values["price"])
+    if "description" in values:
+        values.update(layout_values(values["description"]))
+    return values
+
+async def apply_edits(session: AsyncSession, property_id: int, base_version: int, changes: dict, new_media: list) -> bool:
+    """Один UPDATE изменённых колонок при совпадении version; False — объект изменён или удалён"""
+    values = edit_values(changes)
+    if "price" in values:
+        # новая цена у объекта «в продаже» переводит его в price_changed (историю пишет триггер, см. market_stats.py)
+        values["status"] = case(
+            ((Property.status == PropertyStatus.available) & (Property.price != values["price"]),
+             literal(PropertyStatus.price_changed, Property.status.type)),
+            else_=Property.status)
+    row = (await session.execute(
+        update(Property)
+        .where(Property.id == property_id, Property.version == base_version)
+        .values(**values, version=Property.version + 1)
+        .returning(Property.channel_message_id)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if row is None:
+        return False
+    await add_media(session, property_id, new_media)
+    if "price" in changes:
+        schedule_notify(session, property_id, "price")
+    if row.channel_message_id:
+        await schedule_channel_edit(session, property_id)
+    return True
+
+@dp.callback_query(F.data.startswith("edit_property_"))
+async def start_edit_property(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    property_id = int(callback.data.split("_")[-1])
+    prop = await session.get(Property, property_id)
+    if not prop:
+        await callback.message.edit_text("❌ Объект не найден.")
+        return
+    if prop.created_by != callback.from_user.id and not await is_admin(callback.from_user.id):
+        await callback.message.edit_text("🚫 Вы не можете редактировать этот объект.")
+        return
+
+    await state.update_data(property_id=property_id, base_version=prop.version, changes={}, new_media=[])
+    await state.set_state(EditProperty.field)
+    await callback.message.edit_text("✏ Выберите поле для редактирования.\n"
+                                     "Изменения сохранятся, когда вы нажмёте «Завершить».", reply_markup=edit_menu())
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("edit_field_"))
@@ -332,122 +630,149 @@ async def edit_field(callback: types.CallbackQuery, state: FSMContext):
     field = callback.data.split("_")[-1]
     await state.update_data(edit_field=field)
     await state.set_state(EditProperty.value)
-    field_names = {
-        "location": "локацию",
-        "description": "описание",
-        "condition": "состояние",
-        "parking": "парковку",
-        "bathrooms": "количество санузлов",
-        "additions": "дополнения",
-        "price": "цену",
-        "media": "медиа (прикрепите новые файлы)"
-    }
-    await callback.message.answer(f"Введите новое значение для {field_names[field]}:", reply_markup=ReplyKeyboardRemove())
+    await callback.message.answer(f"Введите новое значение для {EDIT_FIELD_NAMES[field]}:", reply_markup=ReplyKeyboardRemove())
     await callback.answer()
 
-@dp.message(EditProperty.value)
+@dp.message(EditProperty.value, F.text)
 async def save_field(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    property_id = data["property_id"]
     field = data["edit_field"]
 
-    async with AsyncSessionLocal() as session:
-        prop = (await session.execute(select(Property).where(Property.id == property_id))).scalar_one_or_none()
-        if not prop:
-            await message.answer("❌ Объект не найден.")
+    try:
+        if field == "bathrooms":
+            int(message.text)  # Валидация
+        elif field == "price":
+            float(message.text)  # Валидация
+        elif field == "media":
+            await message.answer("❌ Используйте кнопку для загрузки медиа.")
             return
+    except ValueError:
+        await message.answer(f"❌ Пожалуйста, введите корректное значение для {field}.")
+        return
 
-        try:
-            if field == "bathrooms":
-                int(message.text)  # Валидация
-            elif field == "price":
-                float(message.text)  # Валидация
-            elif field == "media":
-                await message.answer("❌ Используйте кнопку для загрузки медиа.")
-                return
-
-            setattr(prop, field, message.text)
-            await session.commit()
-            await message.answer(f"✅ Поле {field} обновлено!")
-        except ValueError:
-            await message.answer(f"❌ Пожалуйста, введите корректное значение для {field}.")
-            return
-        except SQLAlchemyError:
-            await session.rollback()
-            await message.answer("❌ Ошибка при сохранении.")
+    changes = data.get("changes", {})
+    changes[field] = message.text
+    await state.update_data(changes=changes)
+    await state.set_state(EditProperty.field)
+    await message.answer(f"✅ Поле {field} изменено (всего изменений: {len(changes)}).", reply_markup=edit_menu())
 
 @dp.message(EditProperty.value, F.photo | F.video)
-async def save_media(message: types.Message, state: FSMContext):
+async def save_media(message: types.Message, state: FSMContext, album: list[types.Message]):
     data = await state.get_data()
     if data["edit_field"] != "media":
         await message.answer("❌ Используйте кнопку для изменения других полей.")
         return
 
-    property_id = data["property_id"]
-    file_id = message.photo[-1].file_id if message.photo else message.video.file_id
+    new_media = data.get("new_media", [])
+    known = {item["file_unique_id"] for item in new_media}
+    added = [item for item in map(media_from_message, album) if item and item["file_unique_id"] not in known]
+    new_media.extend(added)
+    await state.update_data(new_media=new_media)
+    await message.answer("✅ Медиа добавлено!" if len(added) == 1 else f"✅ Добавлено медиа: {len(added)}!",
+                         reply_markup=edit_menu())
 
-    async with AsyncSessionLocal() as session:
-        prop = (await session.execute(select(Property).where(Property.id == property_id))).scalar_one_or_none()
-        if not prop:
-            await message.answer("❌ Объект не найден.")
-            return
+@dp.callback_query(F.data.in_({"finish_edit", "edit_force"}))
+async def finish_edit(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    data = await state.get_data()
+    property_id = data.get("property_id")
+    changes, new_media = data.get("changes", {}), data.get("new_media", [])
+    # «Применить поверх» — пользователь видел текущую версию в сообщении о конфликте
+    base_version = data.get("conflict_version") if callback.data == "edit_force" else data.get("base_version")
 
+    if changes or new_media:
         try:
-            media = prop.media_group_id.split(",") if prop.media_group_id else []
-            media.append(file_id)
-            prop.media_group_id = ",".join(media)
-            await session.commit()
-            await message.answer("✅ Медиа добавлено!")
-        except SQLAlchemyError:
+            applied = await apply_edits(session, property_id, base_version, changes, new_media)
+        except (IntegrityError, SQLAlchemyError):
             await session.rollback()
-            await message.answer("❌ Ошибка при сохранении.")
-
-@dp.callback_query(F.data == "finish_edit")
-async def finish_edit(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    property_id = data.get("property_id")
-    async with AsyncSessionLocal() as session:
-        prop = (await session.execute(select(Property).where(Property.id == property_id))).scalar_one_or_none()
-        if not prop:
-            await callback.message.edit_text("❌ Объект не найден.")
+            await callback.answer("❌ Ошибка при сохранении.", show_alert=True)
+            return
+        if not applied:
+            await show_edit_conflict(callback, state, session, property_id, changes)
             return
+        await session.commit()
+        outbox_worker.notify()
 
-        text = (
-            f"*Объект #{prop.id}*\n"
-            f"📍 {prop.location}\n"
-            f"🛏 {prop.description}\n"
-            f"🧱 {prop.condition}\n"
-            f"🚗 {prop.parking}\n"
-            f"🚽 {prop.bathrooms}\n"
-            f"✏ {prop.additions}\n"
-            f"💰 *{prop.price}*"
-        )
-        await callback.message.edit_text(f"✅ Редактирование завершено:\n{text}", parse_mode="Markdown",
-                                         reply_markup=property_actions(prop.id, is_admin=callback.from_user.id in ADMIN_IDS))
+    prop = await session.get(Property, property_id)
+    await state.clear()
+    await callback.answer()
+    if not prop:
+        await callback.message.edit_text("❌ Объект не найден.")
+        return
+    text = render_card(prop)
+    await callback.message.edit_text(f"✅ Редактирование завершено:\n{text}", parse_mode="Markdown",
+                                     reply_markup=property_actions(prop.id, is_admin=await is_admin(callback.from_user.id)))
+
+async def show_edit_conflict(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession,
+                             property_id: int, changes: dict):
+    prop = await session.get(Property, property_id)
+    await callback.answer()
+    if not prop:
+        await state.clear()
+        await callback.message.edit_text("❌ Объект удалён, изменения не сохранены.")
+        return
+
+    await state.update_data(conflict_version=prop.version)
+    lines = [f"• {escape_md(field)}: сейчас «{escape_md(getattr(prop, field))}», ваше «{escape_md(value)}»"
+             for field, value in changes.items()]
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Применить поверх", callback_data="edit_force")],
+        [InlineKeyboardButton(text="❌ Отменить мои правки", callback_data="edit_cancel")]
+    ])
+    await callback.message.edit_text(
+        "⚠ *Объект изменил кто-то другой*, пока вы редактировали.\n" + "\n".join(lines),
+        parse_mode="Markdown", reply_markup=kb)
+
+@dp.callback_query(F.data == "edit_cancel")
+async def edit_cancel(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
+    await callback.message.edit_text("❌ Правки отменены, объект не изменён.")
 
 # ---------- DELETE PROPERTY (ADMIN) ----------
 @dp.callback_query(F.data.startswith("delete_property_"))
 @admin_only
-async def delete_property(callback: types.CallbackQuery):
+async def delete_property(callback: types.CallbackQuery, session: AsyncSession):
     property_id = int(callback.data.split("_")[-1])
-    async with AsyncSessionLocal() as session:
-        try:
-            await session.execute(delete(Property).where(Property.id == property_id))
-            await session.commit()
-            await callback.message.edit_text(f"✅ Объект #{property_id} удалён!", reply_markup=admin_menu())
-        except SQLAlchemyError:
-            await session.rollback()
-            await callback.message.edit_text("❌ Ошибка при удалении.")
+    try:
+        deleted = (await session.execute(
+            delete(Property).where(Property.id == property_id)
+            .returning(Property.channel_message_id, Property.channel_media)
+        )).first()
+        if deleted:
+            schedule_channel_delete(session, property_id, *deleted)
+        await session.commit()
+        outbox_worker.notify()
+        await callback.message.edit_text(f"✅ Объект #{property_id} удалён!", reply_markup=admin_menu())
+    except SQLAlchemyError:
+        await session.rollback()
+        await callback.message.edit_text("❌ Ошибка при удалении.")
     await callback.answer()
 
+# ---------- LIFECYCLE ----------
+@dp.startup()
+async def on_startup():
+    global metrics_runner
+    storage.start()
+    outbox_worker.start()
+    metrics_runner = await start_metrics_server()
+
+@dp.shutdown()
+async def on_shutdown():
+    await outbox_worker.stop()
+    await storage.close()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
 # ---------- ENTRY POINT ----------
 if __name__ == "__main__":
     async def main():
-        import models  # регистрация моделей
         await init_db()  # создаём таблицы
         logging.info("Бот запущен...")
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
 
     asyncio.run(main())
@@ -0,0 +1,288 @@
+"""
+Массовый импорт и экспорт объектов (только для админов).
+
+Импорт: документ CSV или JSONL с подписью /import. Файл скачивается во временный
+файл и читается построчно; строки проверяются пачками по CHUNK_SIZE и грузятся
+через COPY (asyncpg) — без ORM и без построчных INSERT. Всё в одной транзакции:
+при ошибке БД не остаётся половины файла. Невалидные строки пропускаются,
+первые MAX_REPORTED_ERRORS из них показываются админу.
+Импортированные объекты в канал не публикуются.
+
+Экспорт: /export [csv|jsonl] [search] — все объекты или по текущим фильтрам /search.
+Строки идут из серверного курсора пачками по CHUNK_SIZE прямо во временный файл.
+"""
+import asyncio
+import csv
+import enum
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import Router, F, types
+from aiogram.fsm.context import FSMContext
+from aiogram.types import FSInputFile
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Property, PropertyStatus, User
+from search_handler import build_filters, get_filters
+from user_cache import is_admin
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 10
+MAX_FILE_SIZE = 20 * 1024 * 1024  # лимит скачивания файлов через Bot API
+
+# колонки, которые заполняет импорт; COPY не применяет default из моделей, поэтому
+# created_at/updated_at/version/status задаются явно
+IMPORT_COLUMNS = [
+    "title", "description", "location", "rooms", "floor", "total_floors", "area", "condition",
+    "parking", "bathrooms", "additions", "price", "status", "created_by", "created_at", "updated_at", "version",
+]
+EXPORT_COLUMNS = [
+    "id", "title", "description", "location", "rooms", "floor", "total_floors", "area", "condition",
+    "parking", "bathrooms", "additions", "price", "status", "created_by", "created_at",
+]
+_TEXT_FIELDS = ["title", "description", "location", "rooms", "floor", "total_floors", "condition",
+                "parking", "additions"]
+_STATUS_BY_VALUE = {status.value.lower(): status for status in PropertyStatus}
+
+
+# ---------- PARSING ----------
+def _decimal(value: Any, field: str) -> Optional[Decimal]:
+    if value in (None, ""):
+        return None
+    try:
+        result = Decimal(str(value).replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"{field}: не число")
+    if result < 0:
+        raise ValueError(f"{field}: отрицательное значение")
+    return result
+
+
+def _status(value: Any) -> PropertyStatus:
+    if value in (None, ""):
+        return PropertyStatus.available
+    text = str(value).strip()
+    if text in PropertyStatus.__members__:
+        return PropertyStatus[text]
+    if text.lower() in _STATUS_BY_VALUE:
+        return _STATUS_BY_VALUE[text.lower()]
+    raise ValueError(f"status: неизвестный статус «{text}»")
+
+
+def parse_row(raw: Dict[str, Any], default_owner: int, now: datetime) -> Dict[str, Any]:
+    """Строка файла -> значения колонок properties; ValueError с причиной, если строка невалидна"""
+    row = {field: (str(raw[field]).strip() or None) if raw.get(field) not in (None, "") else None
+           for field in _TEXT_FIELDS}
+    if not row["location"]:
+        raise ValueError("location: обязательное поле")
+    row["price"] = _decimal(raw.get("price"), "price")
+    if row["price"] is None:
+        raise ValueError("price: обязательное поле")
+    row["area"] = _decimal(raw.get("area"), "area")
+    try:
+        row["bathrooms"] = int(raw["bathrooms"]) if raw.get("bathrooms") not in (None, "") else None
+        row["created_by"] = int(raw["created_by"]) if raw.get("created_by") not in (None, "") else default_owner
+    except (TypeError, ValueError):
+        raise ValueError("bathrooms/created_by: ожидается целое число")
+    row["title"] = row["title"] or row["description"] or row["location"]
+    row["status"] = _status(raw.get("status"))
+    row["created_at"] = row["updated_at"] = now
+    row["version"] = 1
+    return row
+
+
+def iter_raw_rows(path: str, fmt: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(номер строки, сырые значения); файл читается потоково"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_num, row if isinstance(row, dict) else {"__invalid__": line}
+
+
+def take_valid_chunk(rows: Iterator, default_owner: int, size: int, errors: List[str]) -> Tuple[List[Dict], int]:
+    """Следующие size строк: валидные значения и общее число прочитанных строк"""
+    now = datetime.utcnow()
+    valid, read = [], 0
+    for line_num, raw in islice(rows, size):
+        read += 1
+        try:
+            if "__invalid__" in raw:
+                raise ValueError("не JSON‑объект")
+            valid.append(parse_row(raw, default_owner, now))
+        except ValueError as e:
+            errors.append(f"строка {line_num}: {e}")
+    return valid, read
+
+
+# ---------- DATABASE ----------
+def _copy_value(value: Any) -> Any:
+    # COPY минует типы SQLAlchemy: enum в PostgreSQL хранится по имени члена (PgEnum),
+    # а кодек asyncpg для enum принимает только str
+    if isinstance(value, enum.Enum):
+        return value.name
+    return value
+
+
+def copy_records(rows: List[Dict[str, Any]]) -> List[Tuple]:
+    """Строки parse_row -> кортежи для copy_records_to_table в порядке IMPORT_COLUMNS"""
+    return [tuple(_copy_value(row[column]) for column in IMPORT_COLUMNS) for row in rows]
+
+
+async def copy_properties(session: AsyncSession, rows: List[Dict[str, Any]]):
+    if session.bind.dialect.name == "postgresql":
+        # COPY идёт через соединение asyncpg той же транзакции (она уже открыта проверкой владельцев)
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        records = copy_records(rows)
+        await raw.driver_connection.copy_records_to_table(
+            Property.__tablename__, records=records, columns=IMPORT_COLUMNS)
+    else:
+        await session.execute(insert(Property), rows)
+
+
+async def drop_unknown_owners(session: AsyncSession, rows: List[Dict[str, Any]], errors: List[str]) -> List[Dict]:
+    owners = {row["created_by"] for row in rows}
+    known = set((await session.execute(select(User.tg_id).where(User.tg_id.in_(owners)))).scalars())
+    for owner in owners - known:
+        errors.append(f"created_by {owner}: пользователь не найден")
+    return [row for row in rows if row["created_by"] in known]
+
+
+async def import_file(session: AsyncSession, path: str, fmt: str, default_owner: int) -> Tuple[int, int, List[str]]:
+    """Возвращает (загружено, прочитано строк, ошибки); не коммитит — это делает вызывающий (import_document)"""
+    rows = iter_raw_rows(path, fmt)
+    errors: List[str] = []
+    loaded = total = 0
+    while True:
+        # разбор и проверка в потоке, чтобы большой файл не блокировал цикл событий
+        chunk, read = await asyncio.to_thread(take_valid_chunk, rows, default_owner, CHUNK_SIZE, errors)
+        if not read:
+            break
+        total += read
+        chunk = await drop_unknown_owners(session, chunk, errors)
+        if chunk:
+            await copy_properties(session, chunk)
+            loaded += len(chunk)
+    return loaded, total, errors
+
+
+def _export_value(value: Any) -> Any:
+    if isinstance(value, PropertyStatus):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+async def export_file(session: AsyncSession, path: str, fmt: str, filters: List) -> int:
+    columns = [getattr(Property, name) for name in EXPORT_COLUMNS]
+    result = await session.stream(
+        select(*columns).where(*filters).order_by(Property.id).execution_options(yield_per=CHUNK_SIZE))
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+        async for partition in result.partitions():
+            for row in partition:
+                values = [_export_value(value) for value in row]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    f.write(json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False) + "\n")
+            count += len(partition)
+    return count
+
+
+# ---------- HANDLERS ----------
+def _temp_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
+@router.message(F.document, F.caption.startswith("/import"))
+async def import_document(message: types.Message, session: AsyncSession):
+    if not await is_admin(message.from_user.id):
+        await message.answer("🚫 У вас нет доступа.")
+        return
+    document = message.document
+    name = (document.file_name or "").lower()
+    fmt = "csv" if name.endswith(".csv") else "jsonl" if name.endswith((".jsonl", ".ndjson")) else None
+    if fmt is None:
+        await message.answer("❌ Поддерживаются файлы .csv и .jsonl")
+        return
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        await message.answer("❌ Файл больше 20 МБ — разбейте его на части.")
+        return
+
+    path = _temp_path("." + fmt)
+    try:
+        await message.bot.download(document, destination=path)
+        loaded, total, errors = await import_file(session, path, fmt, message.from_user.id)
+        await session.commit()
+    finally:
+        os.remove(path)
+
+    text = f"📥 Импорт завершён: загружено {loaded} из {total} строк."
+    if errors:
+        shown = "\n".join(errors[:MAX_REPORTED_ERRORS])
+        more = f"\n… и ещё {len(errors) - MAX_REPORTED_ERRORS}" if len(errors) > MAX_REPORTED_ERRORS else ""
+        text += f"\n\n⚠ Пропущено ({len(errors)}):\n{shown}{more}"
+    await message.answer(text, parse_mode=None)
+
+
+@router.message(F.text == "/import")
+async def import_help(message: types.Message):
+    if not await is_admin(message.from_user.id):
+        await message.answer("🚫 У вас нет доступа.")
+        return
+    await message.answer(
+        "📥 Отправьте файл .csv (с заголовком) или .jsonl с подписью /import.\n"
+        "Обязательные поля: location, price. Необязательные: " + ", ".join(
+            f for f in IMPORT_COLUMNS[:14] if f not in ("location", "price")) + ".\n"
+        "Без created_by владельцем станет отправитель файла.",
+        parse_mode=None)
+
+
+@router.message(F.text.startswith("/export"))
+async def export_command(message: types.Message, state: FSMContext, session: AsyncSession):
+    if not await is_admin(message.from_user.id):
+        await message.answer("🚫 У вас нет доступа.")
+        return
+    args = message.text.split()[1:]
+    fmt = "jsonl" if "jsonl" in args else "csv"
+    filters = build_filters(await get_filters(state)) if "search" in args else []
+
+    path = _temp_path("." + fmt)
+    try:
+        count = await export_file(session, path, fmt, filters)
+        if not count:
+            await message.answer("🙁 Нет объектов для экспорта.")
+            return
+        filename = f"properties_{datetime.utcnow():%Y%m%d_%H%M}.{fmt}"
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"📤 Объектов: {count}")
+    finally:
+        os.remove(path)
@@ -15,3 +15,46 @@ except ValueError as e:
 
 # ➕ Добавленная переменная по умолчанию (если нужно)
 DEFAULT_USER_ROLE = os.getenv("DEFAULT_USER_ROLE", "user")
+
+# Лимиты исходящих сообщений Telegram (см. send_scheduler.py)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))              # сообщений/сек на бота
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))                   # сообщений/сек в личный чат
+SEND_CHANNEL_RATE_PER_MIN = float(os.getenv("SEND_CHANNEL_RATE_PER_MIN", "20"))  # сообщений/мин в канал/группу
+
+# Кэш пользователей tg_id -> роль (см. user_cache.py)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))  # секунд
+USER_ROLE_POLL = float(os.getenv("USER_ROLE_POLL", "5"))    # сек: как часто процесс сверяет версию ролей
+
+# Режим получения апдейтов: polling | webhook (см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # публичный адрес, например https://example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "32"))   # одновременно обрабатываемых апдейтов
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))  # дальше отвечаем 429, Telegram повторит
+
+# Пул соединений с БД (см. database.py; supervisor делит его между воркерами)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Кол-во процессов‑воркеров в режиме supervisor.py (0 — по числу ядер)
+WORKERS = int(os.getenv("WORKERS", "0")) or os.cpu_count() or 1
+
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (см. metrics.py); 0 — выключено
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Inline‑режим (см. inline_handler.py): кэш ответов по нормализованному запросу
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "2000"))
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "10"))  # секунд
+
+# Ограничение частоты апдейтов от одного пользователя (см. throttle_middleware.py)
+THROTTLE_ENABLED = bool(int(os.getenv("THROTTLE_ENABLED", "1")))
+
+# Реплика только для чтения (см. database.py, db_middleware.py); пусто — всё идёт в основную БД
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL", "")
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))    # после записи пользователь читает из основной
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))     # пауза после ошибки реплики
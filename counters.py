@@ -0,0 +1,179 @@
+"""
+Счётчики админ‑дашборда в таблице stat_counters.
+
+Счётчики ведут триггеры БД, а не код бота: так учитываются любые изменения —
+ORM, Core‑запросы (delete_property), COPY при импорте и массовые UPDATE.
+В PostgreSQL триггеры уровня оператора с transition tables: один UPSERT
+на весь оператор, а не на каждую строку. В SQLite — построчные триггеры.
+Чтение дашборда — несколько выборок по первичному ключу, без сканирования
+users/properties.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import PropertyStatus, StatCounter, UserRole
+from render import escape_md
+
+# выражение ключа: начало локации до запятой в нижнем регистре ({value} — колонка или параметр)
+LOCATION_KEY = {
+    "postgresql": "lower(trim(split_part({value}, ',', 1)))",
+    "sqlite": "lower(trim(substr({value}, 1, instr({value} || ',', ',') - 1)))",
+}
+# корзина цены — три значащие цифры: «<число цифр>:<первые три цифры>» (см. market_stats.py)
+_PRICE_PG = "round(price)::bigint::text"
+_PRICE_SQLITE = "CAST(CAST(round({row}.price) AS INTEGER) AS TEXT)"
+_PRICE_BUCKET_PG = (
+    "CASE WHEN status IN ('available', 'price_changed') AND price >= 1 THEN "
+    + LOCATION_KEY["postgresql"].format(value="location")
+    + f" || '|' || coalesce(rooms, '') || '|' || length({_PRICE_PG}) || ':' || left({_PRICE_PG}, 3) END"
+)
+_PRICE_BUCKET_SQLITE = (
+    "CASE WHEN {row}.status IN ('available', 'price_changed') AND {row}.price >= 1 THEN "
+    + LOCATION_KEY["sqlite"].format(value="{row}.location")
+    + f" || '|' || coalesce({{row}}.rooms, '') || '|' || length({_PRICE_SQLITE}) || ':' || substr({_PRICE_SQLITE}, 1, 3) END"
+)
+
+# таблица -> scope -> (колонки, выражение PostgreSQL, выражение SQLite; {row} — NEW/OLD или имя таблицы)
+# ключ NULL — строка в этом scope не считается
+COUNTED = {
+    "users": {
+        "user_role": ("role", "coalesce(role::text, '')", "coalesce({row}.role, '')"),
+    },
+    "properties": {
+        "property_status": ("status", "coalesce(status::text, '')", "coalesce({row}.status, '')"),
+        "property_creator": ("created_by", "created_by::text", "CAST({row}.created_by AS TEXT)"),
+        "property_day": ("created_at", "coalesce(to_char(created_at, 'YYYY-MM-DD'), '')",
+                         "coalesce(substr({row}.created_at, 1, 10), '')"),
+        # распределение цен активных объектов по локации и комнатам
+        "price_bucket": ("status, location, rooms, price", _PRICE_BUCKET_PG, _PRICE_BUCKET_SQLITE),
+    },
+}
+_UPSERT = ("INSERT INTO stat_counters (scope, key, value) {values} "
+           "ON CONFLICT (scope, key) DO UPDATE SET value = stat_counters.value + excluded.value")
+
+
+# ---------- DDL ----------
+def _pg_statement(table: str, parts: List[Tuple[str, int]]) -> str:
+    selects = " UNION ALL ".join(
+        f"SELECT '{scope}' AS scope, {pg} AS key, {sign} AS delta FROM {relation}"
+        for relation, sign in parts for scope, (_, pg, _) in COUNTED[table].items()
+    )
+    # ORDER BY: одинаковый порядок блокировок строк счётчиков во всех транзакциях
+    return _UPSERT.format(values=(
+        f"SELECT scope, key, sum(delta) FROM ({selects}) d WHERE key IS NOT NULL "
+        "GROUP BY scope, key HAVING sum(delta) <> 0 ORDER BY scope, key"))
+
+
+def _pg_ddl(table: str) -> List[str]:
+    function = f"{table}_counters"
+    body = (
+        f"IF TG_OP = 'INSERT' THEN {_pg_statement(table, [('new_rows', 1)])}; "
+        f"ELSIF TG_OP = 'DELETE' THEN {_pg_statement(table, [('old_rows', -1)])}; "
+        f"ELSE {_pg_statement(table, [('old_rows', -1), ('new_rows', 1)])}; "
+        "END IF; RETURN NULL;"
+    )
+    statements = [
+        f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN {body} END $$",
+    ]
+    for suffix, event, referencing in (
+        ("ins", "INSERT", "NEW TABLE AS new_rows"),
+        ("del", "DELETE", "OLD TABLE AS old_rows"),
+        ("upd", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    ):
+        statements.append(f"DROP TRIGGER IF EXISTS {function}_{suffix} ON {table}")
+        statements.append(
+            f"CREATE TRIGGER {function}_{suffix} AFTER {event} ON {table} "
+            f"REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION {function}()")
+    return statements
+
+
+def _sqlite_ddl(table: str) -> List[str]:
+    function = f"{table}_counters"
+
+    def values(*parts):
+        rows = [f"('{scope}', {lite.format(row=row)}, {sign})"
+                for row, sign in parts for scope, (_, _, lite) in COUNTED[table].items()]
+        return _UPSERT.format(values="SELECT * FROM (VALUES " + ", ".join(rows) + ") WHERE column2 IS NOT NULL")
+
+    columns = ", ".join(dict.fromkeys(
+        column.strip() for columns, _, _ in COUNTED[table].values() for column in columns.split(",")))
+    statements = []
+    # пересоздаём, а не IF NOT EXISTS: набор scope мог измениться
+    for suffix, event, body in (
+        ("ins", "INSERT", values(("NEW", 1))),
+        ("del", "DELETE", values(("OLD", -1))),
+        ("upd", f"UPDATE OF {columns}", values(("OLD", -1), ("NEW", 1))),
+    ):
+        statements.append(f"DROP TRIGGER IF EXISTS {function}_{suffix}")
+        statements.append(f"CREATE TRIGGER {function}_{suffix} AFTER {event} ON {table} BEGIN {body}; END")
+    return statements
+
+
+def rebuild_counters(sync_conn):
+    """Пересчитать счётчики с нуля (полный проход по таблицам)"""
+    postgres = sync_conn.dialect.name == "postgresql"
+    # версия ролей (user_cache.py) — не счётчик, её пересчёт не трогает
+    sync_conn.execute(text("DELETE FROM stat_counters WHERE scope <> 'cache_version'"))
+    for table, scopes in COUNTED.items():
+        for scope, (_, pg, lite) in scopes.items():
+            expression = pg if postgres else lite.format(row=table)
+            sync_conn.execute(text(
+                f"INSERT INTO stat_counters (scope, key, value) "
+                f"SELECT '{scope}', {expression}, count(*) FROM {table} WHERE ({expression}) IS NOT NULL GROUP BY 2"))
+
+
+def install_counters(sync_conn):
+    """Создаёт/обновляет триггеры; если какого‑то scope ещё нет (новая установка или новый scope) — пересчёт"""
+    ddl = _pg_ddl if sync_conn.dialect.name == "postgresql" else _sqlite_ddl
+    for table in COUNTED:
+        for statement in ddl(table):
+            sync_conn.execute(text(statement))
+    present = set(sync_conn.execute(text("SELECT DISTINCT scope FROM stat_counters")).scalars())
+    if not {scope for scopes in COUNTED.values() for scope in scopes} <= present:
+        rebuild_counters(sync_conn)
+
+
+# ---------- DASHBOARD ----------
+async def load_dashboard(session: AsyncSession, days: int = 14, top: int = 10) -> Dict[str, List[Tuple[str, int]]]:
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    totals = (await session.execute(
+        select(StatCounter.scope, StatCounter.key, StatCounter.value)
+        .where(StatCounter.scope.in_(["user_role", "property_status"]), StatCounter.value != 0)
+    )).all()
+    creators = (await session.execute(
+        select(StatCounter.key, StatCounter.value)
+        .where(StatCounter.scope == "property_creator", StatCounter.value > 0)
+        .order_by(StatCounter.value.desc()).limit(top)
+    )).all()
+    per_day = (await session.execute(
+        select(StatCounter.key, StatCounter.value)
+        .where(StatCounter.scope == "property_day", StatCounter.key >= since, StatCounter.value > 0)
+        .order_by(StatCounter.key.desc())
+    )).all()
+    dashboard = {"user_role": [], "property_status": [], "property_creator": list(creators), "property_day": list(per_day)}
+    for scope, key, value in totals:
+        dashboard[scope].append((key, value))
+    return dashboard
+
+
+def _label(enum_cls, key: str) -> str:
+    return enum_cls[key].value if key in enum_cls.__members__ else key
+
+
+def render_dashboard(dashboard: Dict[str, List[Tuple[str, int]]]) -> str:
+    users = dashboard["user_role"]
+    props = dashboard["property_status"]
+    lines = [f"📊 *Статистика*\n\n👥 Пользователей: *{sum(v for _, v in users)}*"]
+    lines += [f"• {escape_md(_label(UserRole, key))}: {value}" for key, value in sorted(users)]
+    lines.append(f"\n🏠 Объектов: *{sum(v for _, v in props)}*")
+    lines += [f"• {escape_md(_label(PropertyStatus, key))}: {value}" for key, value in sorted(props)]
+    if dashboard["property_creator"]:
+        lines.append("\n🏆 *Больше всего объектов:*")
+        lines += [f"• `{key}` — {value}" for key, value in dashboard["property_creator"]]
+    if dashboard["property_day"]:
+        lines.append("\n📅 *Новые объекты по дням:*")
+        lines += [f"• {key}: {value}" for key, value in dashboard["property_day"]]
+    return "\n".join(lines)
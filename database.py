@@ -1,19 +1,124 @@
+import time
+from sqlalchemy import CheckConstraint, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import AddConstraint, CreateColumn
+from sqlalchemy.sql.dml import UpdateBase
 from db_base import Base
-from config import DATABASE_URL
+from config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, REPLICA_DATABASE_URL, REPLICA_RETRY_SECONDS
+
+def _pool_options(url: str) -> dict:
+    # у SQLite нет пула соединений с размером — параметры пула только для серверных БД
+    return {} if url.startswith("sqlite") else {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+    }
 
 engine = create_async_engine(
     DATABASE_URL,
-    echo=bool(int(__debug__))  # echo=True только при дебаге
+    echo=bool(int(__debug__)),  # echo=True только при дебаге
+    **_pool_options(DATABASE_URL),
 )
 
+# ---------- READ REPLICA ----------
+replica_engine = create_async_engine(
+    REPLICA_DATABASE_URL,
+    echo=bool(int(__debug__)),
+    **_pool_options(REPLICA_DATABASE_URL),
+) if REPLICA_DATABASE_URL else None
+_replica_down_until = 0.0
+
+def replica_available() -> bool:
+    return replica_engine is not None and time.monotonic() >= _replica_down_until
+
+def mark_replica_down():
+    """После ошибки реплики REPLICA_RETRY_SECONDS все чтения идут в основную БД"""
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+class RoutingSession(Session):
+    """
+    Чтения сессии с info["replica"] (ставит ReplicaRoutingMiddleware) идут на реплику;
+    flush, INSERT/UPDATE/DELETE и сессии без пометки — в основную БД.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("replica") and not self._flushing and not isinstance(clause, UpdateBase) \
+                and replica_available():
+            self.info["replica_used"] = True
+            return replica_engine.sync_engine
+        return engine.sync_engine
+
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
+    sync_session_class=RoutingSession,
     expire_on_commit=False,
 )
 
-async def init_db():
+def _add_missing_columns(sync_conn):
+    # миграций нет: новые nullable/с server_default колонки добавляем в существующие таблицы
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+def _existing_indexes(sync_conn, table_name):
+    if sync_conn.dialect.name == "sqlite":
+        # рефлексия SQLite пропускает индексы по выражениям (lower(location))
+        return set(sync_conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+            {"table": table_name},
+        ).scalars())
+    return {index["name"] for index in inspect(sync_conn).get_indexes(table_name)}
+
+def _create_missing_indexes(sync_conn):
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        existing = _existing_indexes(sync_conn, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(sync_conn)
+
+def _create_missing_checks(sync_conn):
+    # create_all не добавляет CHECK в существующие таблицы; SQLite не умеет ADD CONSTRAINT
+    if sync_conn.dialect.name != "postgresql":
+        return
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {check["name"] for check in inspector.get_check_constraints(table.name)}
+        for constraint in table.constraints:
+            if isinstance(constraint, CheckConstraint) and constraint.name and constraint.name not in existing:
+                sync_conn.execute(AddConstraint(constraint))
+
+async def init_db() -> int:
+    """Схема, триггеры и перенос старых медиа; возвращает число объектов с перенесёнными медиа"""
+    from counters import install_counters  # триггеры счётчиков дашборда
+    from fulltext import install_fulltext  # tsvector и индексы /find
+    from market_stats import install_market_stats  # история цен и агрегаты /stats
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(_create_missing_checks)
+        await conn.run_sync(install_counters)
+        await conn.run_sync(install_fulltext)
+        await conn.run_sync(install_market_stats)
+    # идемпотентно: без старых media_group_id — один пустой SELECT
+    from media import migrate_legacy_media
+    async with AsyncSessionLocal() as session:
+        return await migrate_legacy_media(session)
+
+def insert_for(session: AsyncSession):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей сессии (PostgreSQL/SQLite)"""
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
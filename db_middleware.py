@@ -0,0 +1,173 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+from config import REPLICA_STICKY_SECONDS
+from database import AsyncSessionLocal, RoutingSession, engine, mark_replica_down, replica_engine
+
+logger = logging.getLogger(__name__)
+
+# больше запросов на один апдейт — повод искать N+1
+QUERY_WARN_THRESHOLD = 15
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+# ---------- ENGINE EVENTS ----------
+# SQLAlchemy переносит contextvars в greenlet драйвера, поэтому статистика
+# попадает в апдейт, который выполнил запрос, даже при параллельной обработке
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - context._query_started
+
+
+for _engine in filter(None, (engine, replica_engine)):
+    event.listen(_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ---------- WRITE TRACKING ----------
+# сессия, которая писала, включает «липкость»: следующие чтения пользователя — из основной БД
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _on_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+# ---------- MIDDLEWARE ----------
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Одна сессия на апдейт: передаётся в хендлеры как `session`, коммитится после
+    успешного хендлера и откатывается при исключении. AsyncSession берёт соединение
+    из пула только при первом запросе, так что апдейты без обращений к БД пул не трогают.
+    Счётчики запросов апдейта доступны хендлерам как `db_stats`.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, warn_threshold: int = QUERY_WARN_THRESHOLD):
+        self.session_factory = session_factory
+        self.warn_threshold = warn_threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        session = self.session_factory()
+        data["session"] = session
+        data["db_stats"] = stats
+        try:
+            result = await handler(event, data)
+            if session.in_transaction():
+                await session.commit()
+            return result
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+            query_stats.reset(token)
+            if stats.count > self.warn_threshold:
+                logger.warning("Апдейт %s выполнил %s SQL‑запросов за %.1f мс",
+                               getattr(event, "update_id", "?"), stats.count, stats.seconds * 1000)
+            elif stats.count:
+                logger.debug("Апдейт %s: %s SQL‑запросов, %.1f мс",
+                             getattr(event, "update_id", "?"), stats.count, stats.seconds * 1000)
+
+
+# ---------- READ REPLICA ----------
+def read_only(handler):
+    """Хендлер только читает: его запросы можно отправить на реплику (см. ReplicaRoutingMiddleware)"""
+    handler.read_only = True
+    return handler
+
+
+class ReplicaRoutingMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware (хендлер уже выбран): сессию хендлера с пометкой read_only
+    направляет на реплику. Пользователь, который недавно писал, REPLICA_STICKY_SECONDS
+    читает из основной БД (реплика могла ещё не догнать его изменения).
+    Ошибка реплики выключает её на REPLICA_RETRY_SECONDS, а хендлер повторяется
+    один раз на основной БД — до первого запроса хендлер ничего не отправляет.
+    """
+
+    def __init__(self, sticky_seconds: float = REPLICA_STICKY_SECONDS):
+        self.sticky_seconds = sticky_seconds
+        self._sticky: Dict[int, float] = {}
+        self.replica_reads = 0
+        self.fallbacks = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        session = data.get("session")
+        user = data.get("event_from_user")
+        callback = getattr(data.get("handler"), "callback", None)
+        if session is None or user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        session.info["replica"] = getattr(callback, "read_only", False) and self._sticky.get(user.id, 0.0) <= now
+        try:
+            result = await handler(event, data)
+            if session.info.get("replica_used"):
+                self.replica_reads += 1
+            return result
+        except (DBAPIError, OSError) as e:
+            if not session.info.get("replica_used"):
+                raise
+            logger.warning("Реплика недоступна, повтор на основной БД: %s", getattr(e, "orig", e))
+            mark_replica_down()
+            self.fallbacks += 1
+            await session.rollback()
+            session.info["replica"] = session.info["replica_used"] = False
+            return await handler(event, data)
+        finally:
+            if session.info.get("wrote"):
+                self._sticky[user.id] = time.monotonic() + self.sticky_seconds
+                if len(self._sticky) > 10000:
+                    self._sticky = {uid: until for uid, until in self._sticky.items() if until > now}
+
+    def stats(self) -> Dict[str, int]:
+        return {"replica_reads": self.replica_reads, "fallbacks": self.fallbacks, "sticky_users": len(self._sticky)}
+
+
+def setup_replica_routing(dp) -> Optional[ReplicaRoutingMiddleware]:
+    """Без REPLICA_DATABASE_URL ничего не регистрирует"""
+    if replica_engine is None:
+        return None
+    middleware = ReplicaRoutingMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(middleware)
+    return middleware
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+from sqlalchemy import delete
+
+from database import AsyncSessionLocal, insert_for
+from models import FSMRecord
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.loaded_at = time.monotonic()
+
+
+class SQLStorage(BaseStorage):
+    """
+    FSM‑хранилище в таблице fsm_states с write‑back кэшем в памяти.
+
+    set_state/set_data только меняют кэш и помечают ключ «грязным»;
+    flush() пишет все грязные ключи одним UPSERT. FSMFlushMiddleware вызывает
+    flush() в конце каждого апдейта, поэтому серия update_data внутри апдейта
+    превращается в одну запись. Чистые записи кэша перечитываются из БД
+    через cache_ttl секунд, так что состояние переживает перезапуск и видно
+    другим процессам (при шардировании по чату — см. supervisor).
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        state_ttl: timedelta = timedelta(days=7),
+        cache_ttl: float = 60,
+        cache_size: int = 10000,
+    ):
+        self.session_factory = session_factory
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: set = set()
+        self._flush_lock = asyncio.Lock()
+        self._janitor: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        k = self._key(key)
+        entry = self._cache.get(k)
+        if entry is not None and (k in self._dirty or time.monotonic() - entry.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(k)
+            return entry
+
+        async with self.session_factory() as session:
+            record = await session.get(FSMRecord, k)
+        # пока шёл запрос, ключ мог быть изменён — грязная запись важнее
+        if k in self._dirty:
+            return self._cache[k]
+        entry = _Entry(record.state, dict(record.data or {})) if record else _Entry(None, {})
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            for k in self._cache:
+                if k not in self._dirty:
+                    del self._cache[k]
+                    break
+            else:
+                return
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._dirty.add(self._key(key))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = data.copy()
+        self._dirty.add(self._key(key))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._janitor:
+            self._janitor.cancel()
+            self._janitor = None
+        await self.flush()
+
+    # ---------- WRITE-BACK ----------
+    async def flush(self) -> int:
+        if not self._dirty:
+            return 0
+        async with self._flush_lock:
+            keys, self._dirty = self._dirty, set()
+            now = datetime.utcnow()
+            upserts, deletes = [], []
+            for k in keys:
+                entry = self._cache.get(k)
+                if entry is None:
+                    continue
+                if entry.state is None and not entry.data:
+                    deletes.append(k)
+                else:
+                    upserts.append({"key": k, "state": entry.state, "data": entry.data.copy(), "updated_at": now})
+
+            try:
+                async with self.session_factory() as session:
+                    if upserts:
+                        insert = insert_for(session)
+                        stmt = insert(FSMRecord).values(upserts)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[FSMRecord.key],
+                            set_={"state": stmt.excluded.state, "data": stmt.excluded.data,
+                                  "updated_at": stmt.excluded.updated_at},
+                        )
+                        await session.execute(stmt)
+                    if deletes:
+                        await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(deletes)))
+                    await session.commit()
+            except Exception:
+                self._dirty |= keys  # повторим при следующем flush
+                raise
+            return len(keys)
+
+    async def expire(self) -> int:
+        """Удалить одним запросом все состояния, не менявшиеся дольше state_ttl"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(FSMRecord).where(FSMRecord.updated_at < datetime.utcnow() - self.state_ttl)
+            )
+            await session.commit()
+        stale = time.monotonic() - self.state_ttl.total_seconds()
+        for k in [k for k, e in self._cache.items() if e.loaded_at < stale and k not in self._dirty]:
+            del self._cache[k]
+        return result.rowcount
+
+    def start(self, flush_interval: float = 5, expire_interval: float = 3600):
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.create_task(self._maintain(flush_interval, expire_interval))
+
+    async def _maintain(self, flush_interval: float, expire_interval: float):
+        last_expire = 0.0
+        while True:
+            await asyncio.sleep(flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_expire >= expire_interval:
+                    removed = await self.expire()
+                    last_expire = time.monotonic()
+                    if removed:
+                        logger.info("Удалено устаревших FSM‑состояний: %s", removed)
+            except Exception:
+                logger.exception("Ошибка обслуживания FSM‑хранилища")
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Сбрасывает накопленные изменения FSM одной записью после каждого апдейта"""
+
+    def __init__(self, storage: SQLStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                await self.storage.flush()
+            except Exception:
+                logger.exception("Не удалось сохранить FSM‑состояние, повтор в фоне")
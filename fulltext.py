@@ -0,0 +1,123 @@
+"""
+Полнотекстовый поиск по объектам (/find).
+
+PostgreSQL: генерируемая колонка properties.search_vector (tsvector, конфигурация
+russian; веса title A > location B > description C > additions D) с GIN‑индексом.
+Колонка считается самой БД, поэтому актуальна при любых изменениях — ORM,
+Core‑UPDATE, COPY при импорте. Если по словам ничего не нашлось (опечатка),
+ищем по триграммам (pg_trgm, word_similarity) с GIN‑индексом по тексту объекта.
+
+В модели колонки нет: она нужна только запросам этого модуля и не должна
+попадать в SELECT обычных списков. В SQLite (разработка) — LIKE по всем словам.
+"""
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, literal_column, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Property
+
+FTS_CONFIG = "russian"
+_REGCONFIG = literal_column(f"'{FTS_CONFIG}'::regconfig")  # константой, а не параметром asyncpg
+MIN_QUERY_LENGTH = 2
+# текст объекта для триграмм; одно и то же выражение в индексе и в запросе
+SEARCH_DOCUMENT = ("lower(coalesce(title, '') || ' ' || coalesce(location, '') || ' ' || "
+                   "coalesce(description, '') || ' ' || coalesce(additions, ''))")
+_WEIGHTS = (("title", "A"), ("location", "B"), ("description", "C"), ("additions", "D"))
+
+# выставляется install_fulltext: pg_trgm может быть недоступен (нет прав на CREATE EXTENSION)
+trigram_enabled = False
+
+
+# ---------- DDL ----------
+def _search_vector_sql() -> str:
+    return " || ".join(f"setweight(to_tsvector('{FTS_CONFIG}', coalesce({column}, '')), '{weight}')"
+                       for column, weight in _WEIGHTS)
+
+
+def install_fulltext(sync_conn):
+    """Колонка search_vector и индексы поиска; повторный вызов ничего не меняет"""
+    global trigram_enabled
+    if sync_conn.dialect.name != "postgresql":
+        return
+    sync_conn.execute(text(
+        f"ALTER TABLE properties ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({_search_vector_sql()}) STORED"))
+    sync_conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_properties_search_vector ON properties USING gin (search_vector)"))
+
+    savepoint = sync_conn.begin_nested()
+    try:
+        sync_conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        sync_conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_properties_search_trgm ON properties "
+            f"USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)"))
+        savepoint.commit()
+        trigram_enabled = True
+    except Exception:
+        savepoint.rollback()
+        trigram_enabled = False
+
+
+# ---------- QUERY ----------
+async def find_properties(session: AsyncSession, query: str, offset: int = 0, limit: int = 8,
+                          mode: Optional[str] = None) -> Tuple[List[Property], bool, str]:
+    """
+    Активные объекты по тексту, от самых релевантных; (страница, есть ли следующая, режим).
+    Ранжированный результат не даёт keyset‑курсора, поэтому страницы — по OFFSET.
+    mode — режим, которым найдена первая страница («fts», «trigram», «like»): вызывающий
+    хранит его и передаёт для следующих страниц, иначе после фолбэка на триграммы
+    вторая страница снова искала бы по словам и оказывалась пустой.
+    """
+    if session.bind.dialect.name != "postgresql":
+        mode = "like"
+    elif mode not in ("fts", "trigram"):  # нет режима или чужой (offset inline‑запроса приходит от клиента)
+        rows = await _find_fts(session, query, offset, limit + 1)
+        if rows or not trigram_enabled:
+            return rows[:limit], len(rows) > limit, "fts"
+        mode = "trigram"
+    finder = {"like": _find_like, "fts": _find_fts, "trigram": _find_trigram}[mode]
+    rows = await finder(session, query, offset, limit + 1)
+    return rows[:limit], len(rows) > limit, mode
+
+
+async def _find_fts(session: AsyncSession, query: str, offset: int, limit: int) -> List[Property]:
+    vector = literal_column("properties.search_vector")
+    tsquery = func.websearch_to_tsquery(_REGCONFIG, query)
+    stmt = (
+        select(Property)
+        .where(vector.op("@@")(tsquery), Property.active())
+        .order_by(func.ts_rank_cd(vector, tsquery).desc(), Property.id.desc())
+        .offset(offset).limit(limit)
+    )
+    return list((await session.execute(stmt)).scalars())
+
+
+async def _find_trigram(session: AsyncSession, query: str, offset: int, limit: int) -> List[Property]:
+    # «<%» — оператор word_similarity, его обслуживает индекс gin_trgm_ops
+    document = literal_column(SEARCH_DOCUMENT)
+    needle = query.lower()
+    stmt = (
+        select(Property)
+        .where(text(f":needle <% {SEARCH_DOCUMENT}").bindparams(needle=needle), Property.active())
+        .order_by(func.word_similarity(needle, document).desc(), Property.id.desc())
+        .offset(offset).limit(limit)
+    )
+    return list((await session.execute(stmt)).scalars())
+
+
+async def _find_like(session: AsyncSession, query: str, offset: int, limit: int) -> List[Property]:
+    columns = (Property.title, Property.location, Property.description, Property.additions)
+    conditions = []
+    for word in query.lower().split():
+        # lower() и LIKE в SQLite регистронезависимы только для ASCII — добавляем «Слово»
+        escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        patterns = {f"%{escaped}%", f"%{escaped.capitalize()}%"}
+        conditions.append(or_(*(column.like(pattern, escape="\\") for column in columns for pattern in patterns)))
+    stmt = (
+        select(Property)
+        .where(and_(*conditions), Property.active())
+        .order_by(Property.created_at.desc(), Property.id.desc())
+        .offset(offset).limit(limit)
+    )
+    return list((await session.execute(stmt)).scalars())
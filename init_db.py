@@ -1,15 +1,13 @@
 import asyncio
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
-from db_base import Base
-from config import DATABASE_URL
+from database import init_db as create_tables
 import models  # обязательно импортируй модели!
 
-engine: AsyncEngine = create_async_engine(DATABASE_URL, echo=True)
-
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # перенос старых медиа в property_media выполняет сам database.init_db (и при старте бота)
+    migrated = await create_tables()
     print("✅ Таблицы успешно созданы.")
+    if migrated:
+        print(f"✅ Медиа перенесены в property_media для {migrated} объектов.")
 
 if __name__ == "__main__":
     asyncio.run(init_db())
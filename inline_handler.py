@@ -0,0 +1,112 @@
+"""
+Inline‑режим: «@bot <запрос>» в любом чате — карточки объектов для отправки.
+
+Запрос: «#123»/«123» — объект по id, текст — полнотекстовый поиск (fulltext.py),
+пусто — новые активные объекты. Превью — первое фото/видео объекта (cached‑результаты
+по file_id), без медиа — статья с текстом карточки.
+
+Ответы кэшируются на INLINE_CACHE_TTL по (нормализованный запрос, offset) и не
+зависят от пользователя: серия одинаковых нажатий клавиш от многих агентов —
+один запрос к БД (AsyncTTLCache схлопывает и одновременные промахи).
+Inline‑режим нужно включить у @BotFather (/setinline).
+"""
+import re
+from typing import List, Tuple
+
+from aiogram import Router, types
+from aiogram.types import (
+    InlineQueryResultArticle, InlineQueryResultCachedPhoto, InlineQueryResultCachedVideo,
+    InlineQueryResultsButton, InputTextMessageContent,
+)
+from sqlalchemy import func, select
+
+from cache import AsyncTTLCache
+from config import INLINE_CACHE_SIZE, INLINE_CACHE_TTL
+from database import AsyncSessionLocal
+from fulltext import MIN_QUERY_LENGTH, find_properties
+from models import MediaType, Property, PropertyMedia
+from pagination import fetch_page
+from render import render_card
+from user_cache import get_user_info
+
+router = Router()
+
+INLINE_PAGE_SIZE = 20  # Telegram принимает до 50 результатов
+CAPTION_LIMIT = 1024
+_ID_QUERY = re.compile(r"#?(\d+)")
+
+# (запрос, offset) -> (результаты, next_offset)
+inline_cache = AsyncTTLCache(maxsize=INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+# ---------- LOADING ----------
+async def _first_media(session, property_ids: List[int]) -> dict:
+    """Первое медиа каждого объекта одним запросом (row_number по позиции)"""
+    if not property_ids:
+        return {}
+    number = func.row_number().over(
+        partition_by=PropertyMedia.property_id, order_by=(PropertyMedia.position, PropertyMedia.id)).label("n")
+    ranked = (
+        select(PropertyMedia.property_id, PropertyMedia.file_id, PropertyMedia.media_type, number)
+        .where(PropertyMedia.property_id.in_(property_ids))
+        .subquery()
+    )
+    rows = await session.execute(
+        select(ranked.c.property_id, ranked.c.file_id, ranked.c.media_type).where(ranked.c.n == 1))
+    return {row.property_id: row for row in rows}
+
+
+async def _search(session, query: str, offset: str) -> Tuple[List[Property], str]:
+    match = _ID_QUERY.fullmatch(query)
+    if match:
+        prop = None if offset else await session.get(Property, int(match.group(1)))
+        return ([prop] if prop else []), ""
+    if len(query) >= MIN_QUERY_LENGTH:
+        # offset текстового поиска — «режим:смещение», чтобы страницы после фолбэка шли тем же режимом
+        mode, _, start = offset.rpartition(":")
+        start = int(start) if start.isdigit() else 0
+        props, has_next, mode = await find_properties(session, query, start, INLINE_PAGE_SIZE, mode or None)
+        return props, f"{mode}:{start + INLINE_PAGE_SIZE}" if has_next else ""
+    # пустой запрос — лента новых объектов; next_offset — keyset‑курсор (pagination.py)
+    page = await fetch_page(session, Property.active(), cursor=offset, page_size=INLINE_PAGE_SIZE)
+    return page.items, page.last_cursor if page.has_next else ""
+
+
+def _result(prop: Property, media) -> types.InlineQueryResult:
+    text = render_card(prop, "public")
+    title = f"#{prop.id} · {prop.location or 'без локации'}"
+    description = f"💰 {prop.price} · {prop.description or ''}".strip(" ·")
+    if media is not None and len(text) <= CAPTION_LIMIT:
+        if media.media_type == MediaType.video:
+            return InlineQueryResultCachedVideo(id=str(prop.id), video_file_id=media.file_id, title=title,
+                                                description=description, caption=text, parse_mode="Markdown")
+        return InlineQueryResultCachedPhoto(id=str(prop.id), photo_file_id=media.file_id, title=title,
+                                            description=description, caption=text, parse_mode="Markdown")
+    return InlineQueryResultArticle(
+        id=str(prop.id), title=title, description=description,
+        input_message_content=InputTextMessageContent(message_text=text, parse_mode="Markdown"))
+
+
+async def load_results(query: str, offset: str) -> Tuple[list, str]:
+    # своя сессия, а не сессия апдейта: результатом пользуются все схлопнутые запросы
+    async with AsyncSessionLocal() as session:
+        props, next_offset = await _search(session, query, offset)
+        media = await _first_media(session, [prop.id for prop in props])
+    return [_result(prop, media.get(prop.id)) for prop in props], next_offset
+
+
+# ---------- HANDLER ----------
+@router.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    if not (await get_user_info(inline_query.from_user.id)).exists:
+        await inline_query.answer([], cache_time=60, is_personal=True, button=InlineQueryResultsButton(
+            text="Зарегистрируйтесь в боте", start_parameter="inline"))
+        return
+
+    query, offset = normalize_query(inline_query.query), inline_query.offset or ""
+    results, next_offset = await inline_cache.get_or_load((query, offset), lambda: load_results(query, offset))
+    await inline_query.answer(results, cache_time=int(INLINE_CACHE_TTL), next_offset=next_offset)
@@ -0,0 +1,221 @@
+"""
+История цен и рыночная статистика для /stats <локация>.
+
+Всё ведёт БД, как и счётчики дашборда (counters.py):
+- price_history — строка на каждую цену объекта (INSERT и изменение price),
+  пишется триггером, поэтому учитываются правки, Core‑UPDATE и COPY при импорте;
+- price_daily — тем же триггером: дневные count/sum цен по локации и комнатам
+  (для тренда за 30 дней);
+- распределение цен активных объектов — scope price_bucket в stat_counters
+  (корзины по три значащие цифры): из него count, медиана, мин/макс с точностью ~1%.
+
+/stats читает только эти агрегаты по ключу локации — без прохода по properties.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from counters import LOCATION_KEY
+from models import PriceDaily, StatCounter
+from render import escape_md
+
+TREND_DAYS = 30
+
+
+# ---------- DDL ----------
+_PG_DAILY = (
+    "INSERT INTO price_daily (location, rooms, day, count, total) "
+    "SELECT {location}, coalesce(rooms, ''), to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD'), count(*), sum(new_price) "
+    "FROM changed WHERE location IS NOT NULL GROUP BY 1, 2 ORDER BY 1, 2 "
+    "ON CONFLICT (location, rooms, day) DO UPDATE "
+    "SET count = price_daily.count + excluded.count, total = price_daily.total + excluded.total"
+)
+_PG_CHANGED = {
+    "INSERT": "SELECT id, NULL::numeric AS old_price, price AS new_price, location, rooms "
+              "FROM new_rows WHERE price IS NOT NULL",
+    "UPDATE": "SELECT n.id, o.price AS old_price, n.price AS new_price, n.location, n.rooms "
+              "FROM new_rows n JOIN old_rows o ON o.id = n.id "
+              "WHERE n.price IS NOT NULL AND n.price IS DISTINCT FROM o.price",
+}
+
+
+def _pg_statement(changed: str) -> str:
+    # одна команда: отобранные строки пишутся и в историю, и в дневные суммы
+    return (
+        f"WITH changed AS ({changed}), logged AS ("
+        "INSERT INTO price_history (property_id, old_price, new_price, changed_at) "
+        "SELECT id, old_price, new_price, now() AT TIME ZONE 'utc' FROM changed) "
+        + _PG_DAILY.format(location=LOCATION_KEY["postgresql"].format(value="location"))
+    )
+
+
+def _pg_ddl() -> List[str]:
+    body = (f"IF TG_OP = 'INSERT' THEN {_pg_statement(_PG_CHANGED['INSERT'])}; "
+            f"ELSE {_pg_statement(_PG_CHANGED['UPDATE'])}; END IF; RETURN NULL;")
+    statements = [
+        "CREATE OR REPLACE FUNCTION properties_price_history() RETURNS trigger LANGUAGE plpgsql "
+        f"AS $$ BEGIN {body} END $$",
+    ]
+    # триггеры с transition tables не допускают UPDATE OF <колонки> — фильтр по цене внутри функции
+    for suffix, event, referencing in (
+        ("ins", "INSERT", "NEW TABLE AS new_rows"),
+        ("upd", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    ):
+        statements.append(f"DROP TRIGGER IF EXISTS properties_price_history_{suffix} ON properties")
+        statements.append(
+            f"CREATE TRIGGER properties_price_history_{suffix} AFTER {event} ON properties "
+            f"REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION properties_price_history()")
+    return statements
+
+
+def _sqlite_ddl() -> List[str]:
+    location = LOCATION_KEY["sqlite"].format(value="NEW.location")
+
+    def body(old_price: str) -> str:
+        return (
+            "INSERT INTO price_history (property_id, old_price, new_price, changed_at) "
+            f"VALUES (NEW.id, {old_price}, NEW.price, datetime('now')); "
+            "INSERT INTO price_daily (location, rooms, day, count, total) "
+            f"SELECT {location}, coalesce(NEW.rooms, ''), date('now'), 1, NEW.price WHERE NEW.location IS NOT NULL "
+            "ON CONFLICT (location, rooms, day) DO UPDATE "
+            "SET count = price_daily.count + excluded.count, total = price_daily.total + excluded.total;"
+        )
+
+    return [
+        "DROP TRIGGER IF EXISTS properties_price_history_ins",
+        "CREATE TRIGGER properties_price_history_ins AFTER INSERT ON properties WHEN NEW.price IS NOT NULL "
+        f"BEGIN {body('NULL')} END",
+        "DROP TRIGGER IF EXISTS properties_price_history_upd",
+        "CREATE TRIGGER properties_price_history_upd AFTER UPDATE OF price ON properties "
+        f"WHEN NEW.price IS NOT NULL AND NEW.price IS NOT OLD.price BEGIN {body('OLD.price')} END",
+    ]
+
+
+def backfill_price_history(sync_conn):
+    """Первая установка: текущие цены объектов — начальные записи истории и дневных сумм"""
+    postgres = sync_conn.dialect.name == "postgresql"
+    location = LOCATION_KEY[sync_conn.dialect.name].format(value="p.location")
+    day = "to_char(h.changed_at, 'YYYY-MM-DD')" if postgres else "substr(h.changed_at, 1, 10)"
+    now = "now() AT TIME ZONE 'utc'" if postgres else "datetime('now')"
+    sync_conn.execute(text(
+        "INSERT INTO price_history (property_id, old_price, new_price, changed_at) "
+        f"SELECT id, NULL, price, coalesce(created_at, {now}) FROM properties WHERE price IS NOT NULL"))
+    sync_conn.execute(text("DELETE FROM price_daily"))
+    sync_conn.execute(text(
+        "INSERT INTO price_daily (location, rooms, day, count, total) "
+        f"SELECT {location}, coalesce(p.rooms, ''), {day}, count(*), sum(h.new_price) "
+        "FROM price_history h JOIN properties p ON p.id = h.property_id "
+        "WHERE p.location IS NOT NULL GROUP BY 1, 2, 3"))
+
+
+def install_market_stats(sync_conn):
+    ddl = _pg_ddl() if sync_conn.dialect.name == "postgresql" else _sqlite_ddl()
+    for statement in ddl:
+        sync_conn.execute(text(statement))
+    if sync_conn.execute(text("SELECT 1 FROM price_history LIMIT 1")).first() is None:
+        backfill_price_history(sync_conn)
+
+
+# ---------- READ ----------
+@dataclass
+class PriceSummary:
+    count: int
+    median: int
+    low: int
+    high: int
+
+
+def _bucket(raw: str) -> Tuple[int, int]:
+    """«6:901» -> (начало корзины 90100, ширина 100)"""
+    digits, lead = raw.split(":")
+    width = 10 ** max(int(digits) - len(lead), 0)
+    return int(lead) * width, width
+
+
+def summarize(buckets: Dict[int, Tuple[int, int]]) -> Optional[PriceSummary]:
+    """buckets: начало -> (ширина, count); медиана — середина корзины, где накопленный count достиг половины"""
+    total = sum(count for _, count in buckets.values())
+    if not total:
+        return None
+    ordered = sorted(buckets.items())
+    seen, median = 0, ordered[-1][0]
+    for start, (width, count) in ordered:
+        seen += count
+        if seen * 2 >= total:
+            median = start + width // 2
+            break
+    low = ordered[0][0]
+    high_start, (high_width, _) = ordered[-1]
+    return PriceSummary(count=total, median=median, low=low, high=high_start + high_width - 1)
+
+
+@dataclass
+class MarketStats:
+    location: str
+    overall: Optional[PriceSummary]
+    by_rooms: List[Tuple[str, PriceSummary]]
+    trend: Optional[float]   # изменение средней цены за TREND_DAYS к предыдущему периоду
+
+
+async def load_market_stats(session: AsyncSession, location: str) -> MarketStats:
+    dialect = session.bind.dialect.name
+    # ключ считает то же SQL‑выражение, что и триггеры (регистр и обрезка совпадают)
+    key = (await session.execute(text("SELECT " + LOCATION_KEY[dialect].format(value=":location")),
+                                 {"location": location})).scalar_one()
+    rows = (await session.execute(
+        select(StatCounter.key, StatCounter.value)
+        .where(StatCounter.scope == "price_bucket", StatCounter.key.startswith(key + "|", autoescape=True),
+               StatCounter.value > 0)
+    )).all()
+
+    overall: Dict[int, Tuple[int, int]] = {}
+    rooms: Dict[str, Dict[int, Tuple[int, int]]] = {}
+    for raw, count in rows:
+        _, room, bucket = raw.rsplit("|", 2)
+        start, width = _bucket(bucket)
+        overall[start] = (width, overall.get(start, (width, 0))[1] + count)
+        per_room = rooms.setdefault(room, {})
+        per_room[start] = (width, per_room.get(start, (width, 0))[1] + count)
+
+    today = datetime.utcnow().date()
+    since = (today - timedelta(days=TREND_DAYS)).isoformat()
+    recent = PriceDaily.day > since
+    sums = (await session.execute(
+        select(recent.label("recent"), func.sum(PriceDaily.count), func.sum(PriceDaily.total))
+        .where(PriceDaily.location == key,
+               PriceDaily.day > (today - timedelta(days=2 * TREND_DAYS)).isoformat())
+        .group_by(recent)
+    )).all()
+    averages = {bool(is_recent): total / count for is_recent, count, total in sums if count}
+    trend = averages[True] / averages[False] - 1 if True in averages and averages.get(False) else None
+
+    by_rooms = sorted(((room, summarize(b)) for room, b in rooms.items()), key=lambda item: item[0])
+    return MarketStats(location=key, overall=summarize(overall), by_rooms=by_rooms, trend=trend)
+
+
+def _money(value: int) -> str:
+    return f"{value:,}".replace(",", " ")
+
+
+def render_market_stats(stats: MarketStats) -> str:
+    title = f"📈 *Рынок: {escape_md(stats.location)}*"
+    if stats.overall is None:
+        return f"{title}\n\n🙁 Нет активных объектов с ценой."
+    o = stats.overall
+    lines = [
+        title,
+        f"\n🏠 В продаже: *{o.count}*",
+        f"💰 Медиана: *~{_money(o.median)}*",
+        f"↕ Мин/макс: ~{_money(o.low)} – ~{_money(o.high)}",
+    ]
+    if stats.trend is not None:
+        arrow = "📈" if stats.trend >= 0 else "📉"
+        lines.append(f"{arrow} За {TREND_DAYS} дней: {stats.trend * 100:+.1f}% к средней цене прошлого периода")
+    if len(stats.by_rooms) > 1 or (stats.by_rooms and stats.by_rooms[0][0]):
+        lines.append("\n🛏 *По комнатам:*")
+        lines += [f"• {escape_md(room) or 'не указано'}: {s.count} шт., медиана ~{_money(s.median)} "
+                  f"({_money(s.low)} – {_money(s.high)})" for room, s in stats.by_rooms]
+    return "\n".join(lines)
@@ -0,0 +1,101 @@
+from typing import Any, Dict, List, Optional
+
+from aiogram import types
+from aiogram.types import InputMediaPhoto, InputMediaVideo
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import insert_for
+from models import MediaType, Property, PropertyMedia
+
+# Telegram принимает в sendMediaGroup от 2 до 10 элементов
+ALBUM_LIMIT = 10
+
+
+def media_from_message(message: types.Message) -> Optional[Dict[str, Any]]:
+    """Описание фото/видео из сообщения в виде, пригодном для FSM‑данных и add_media"""
+    if message.photo:
+        photo = message.photo[-1]
+        return {"file_id": photo.file_id, "file_unique_id": photo.file_unique_id, "type": MediaType.photo.value}
+    if message.video:
+        video = message.video
+        return {"file_id": video.file_id, "file_unique_id": video.file_unique_id, "type": MediaType.video.value}
+    return None
+
+
+async def add_media(session: AsyncSession, property_id: int, items: List[Dict[str, Any]]):
+    """
+    Добавить медиа одним INSERT; позиции продолжают текущий максимум,
+    повторно присланный файл (тот же file_unique_id) пропускается.
+    """
+    if not items:
+        return
+    next_position = (
+        select(func.coalesce(func.max(PropertyMedia.position), -1) + 1)
+        .where(PropertyMedia.property_id == property_id)
+        .scalar_subquery()
+    )
+    insert = insert_for(session)
+    stmt = insert(PropertyMedia).values([
+        {
+            "property_id": property_id,
+            "file_id": item["file_id"],
+            "file_unique_id": item["file_unique_id"],
+            "media_type": MediaType(item["type"]),
+            "position": next_position + i,
+        }
+        for i, item in enumerate(items)
+    ])
+    await session.execute(stmt.on_conflict_do_nothing(index_elements=["property_id", "file_unique_id"]))
+
+
+async def load_media(session: AsyncSession, property_id: int) -> List[PropertyMedia]:
+    return list((await session.execute(
+        select(PropertyMedia)
+        .where(PropertyMedia.property_id == property_id)
+        .order_by(PropertyMedia.position, PropertyMedia.id)
+    )).scalars().all())
+
+
+def input_media(item: PropertyMedia):
+    if item.media_type == MediaType.video:
+        return InputMediaVideo(media=item.file_id)
+    return InputMediaPhoto(media=item.file_id)
+
+
+def album_chunks(media: List[PropertyMedia]) -> List[list]:
+    """Разбить медиа на альбомы по ALBUM_LIMIT элементов"""
+    return [[input_media(m) for m in media[i:i + ALBUM_LIMIT]] for i in range(0, len(media), ALBUM_LIMIT)]
+
+
+# ---------- MIGRATION ----------
+async def migrate_legacy_media(session: AsyncSession, batch_size: int = 500) -> int:
+    """
+    Одноразовый перенос Property.media_group_id («id1,id2,...») в property_media.
+    Тип угадывается по префиксу file_id, как это делал старый код публикации;
+    file_unique_id для старых записей неизвестен, вместо него берётся file_id.
+    """
+    migrated = 0
+    while True:
+        rows = (await session.execute(
+            select(Property.id, Property.media_group_id)
+            .where(Property.media_group_id.is_not(None), Property.media_group_id != "")
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            return migrated
+        for property_id, raw in rows:
+            add = [
+                {
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "type": (MediaType.photo if file_id.startswith("Ag") else MediaType.video).value,
+                }
+                for file_id in raw.split(",") if file_id
+            ]
+            await add_media(session, property_id, add)
+        await session.execute(
+            update(Property).where(Property.id.in_([r.id for r in rows])).values(media_group_id=None)
+        )
+        await session.commit()
+        migrated += len(rows)
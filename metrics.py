@@ -0,0 +1,274 @@
+"""
+Метрики в формате Prometheus на локальном HTTP‑эндпоинте (METRICS_PORT).
+
+Если METRICS_PORT не задан, setup_metrics ничего не регистрирует: ни middleware,
+ни обработчиков событий SQLAlchemy — накладных расходов нет.
+"""
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramConflictError, TelegramEntityTooLarge, TelegramForbiddenError,
+    TelegramNetworkError, TelegramNotFound, TelegramRetryAfter, TelegramServerError,
+    TelegramUnauthorizedError,
+)
+from aiogram.methods.base import Response, TelegramMethod, TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+# ---------- REGISTRY ----------
+def _escape_label(value: Any) -> str:
+    # текстовый формат Prometheus: в значении метки экранируются \\, " и перевод строки
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, Any] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+    def render(self) -> str:
+        documentation = self.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines = [f"# HELP {self.name} {documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.collect:
+            self._values = dict(self.collect())
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+REGISTRY: list = []
+
+
+def render_all() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# ---------- METRICS ----------
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время выполнения хендлера", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ["handler"])
+UPDATE_DB_QUERIES = Histogram("bot_update_db_queries", "SQL‑запросов на апдейт", ["handler"], COUNT_BUCKETS)
+UPDATE_DB_SECONDS = Histogram("bot_update_db_seconds", "Время SQL‑запросов на апдейт", ["handler"])
+FSM_STATES = Counter("bot_fsm_state_updates_total", "Апдейты по текущему состоянию FSM", ["state"])
+API_LATENCY = Histogram("telegram_api_seconds", "Время вызова Bot API", ["method"])
+API_ERRORS = Counter("telegram_api_errors_total", "Ошибки Bot API", ["method", "code"])
+POOL_WAIT = Histogram("db_pool_checkout_seconds", "Ожидание соединения из пула (первый запрос сессии)")
+
+_API_ERROR_CODES = (
+    (TelegramRetryAfter, "429"), (TelegramBadRequest, "400"), (TelegramUnauthorizedError, "401"),
+    (TelegramForbiddenError, "403"), (TelegramNotFound, "404"), (TelegramConflictError, "409"),
+    (TelegramEntityTooLarge, "413"), (TelegramServerError, "5xx"), (TelegramNetworkError, "network"),
+)
+
+
+def _error_code(error: Exception) -> str:
+    for cls, code in _API_ERROR_CODES:
+        if isinstance(error, cls):
+            return code
+    return "other"
+
+
+# ---------- MIDDLEWARES ----------
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: к этому моменту aiogram уже выбрал хендлер (data["handler"])"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        FSM_STATES.inc(state=data.get("raw_state") or "none")
+        stats = data.get("db_stats")
+        queries_before = stats.count if stats is not None else 0
+        seconds_before = stats.seconds if stats is not None else 0.0
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+            if stats is not None:
+                UPDATE_DB_QUERIES.observe(stats.count - queries_before, handler=name)
+                UPDATE_DB_SECONDS.observe(stats.seconds - seconds_before, handler=name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method=name, code=_error_code(e))
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, method=name)
+
+
+# ---------- SQLALCHEMY ----------
+def _on_orm_execute(orm_execute_state):
+    info = orm_execute_state.session.info
+    if not info.get("connected"):
+        info.setdefault("checkout_started", time.perf_counter())
+
+
+def _on_after_begin(session, transaction, connection):
+    started = session.info.pop("checkout_started", None)
+    session.info["connected"] = True
+    if started is not None:
+        POOL_WAIT.observe(time.perf_counter() - started)
+
+
+def _on_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("connected", None)
+
+
+def _pool_gauges(engine):
+    pool = engine.pool
+
+    def collect():
+        values = {}
+        for name in ("size", "checkedout", "overflow", "checkedin"):
+            method = getattr(pool, name, None)
+            if method:
+                values[(name,)] = method()
+        return values
+    return collect
+
+
+# ---------- SETUP ----------
+def _stats_gauge(stats: Callable[[], Dict[str, float]]):
+    return lambda: {(key,): value for key, value in stats().items()}
+
+
+def setup_metrics(dp: Dispatcher, bot: Bot, engine, stats: Optional[Dict[str, Callable[[], Dict[str, float]]]] = None) -> bool:
+    """
+    Подключает сбор метрик. stats — дополнительные источники вида name -> stats(),
+    отдаются как gauge {name}{key="..."} в момент запроса /metrics.
+    """
+    if not METRICS_PORT:
+        return False
+
+    middleware = HandlerMetricsMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(middleware)
+    # регистрируем последним, чтобы мерить сам HTTP‑вызов, а не ожидание в SendScheduler
+    bot.session.middleware(ApiMetricsMiddleware())
+
+    event.listen(Session, "do_orm_execute", _on_orm_execute)
+    event.listen(Session, "after_begin", _on_after_begin)
+    event.listen(Session, "after_transaction_end", _on_transaction_end)
+    Gauge("db_pool_connections", "Состояние пула соединений", ["kind"], collect=_pool_gauges(engine.sync_engine))
+
+    for name, collect in (stats or {}).items():
+        Gauge(name, f"Статистика {name}", ["key"], collect=_stats_gauge(collect))
+    return True
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    if not METRICS_PORT:
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render_all(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info("Метрики: http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
@@ -1,6 +1,7 @@
 from sqlalchemy import (
     Column, Integer, BigInteger, String,
-    Enum as PgEnum, ForeignKey, DateTime, Numeric
+    Enum as PgEnum, ForeignKey, DateTime, Numeric, Index, JSON, text, func,
+    UniqueConstraint, CheckConstraint
 )
 from sqlalchemy.orm import relationship
 from db_base import Base
@@ -19,6 +20,21 @@ class PropertyStatus(enum.Enum):
     price_changed = "Снижение/Повышение цены"
     removed = "Снято с продажи"
 
+class MediaType(enum.Enum):
+    photo = "photo"
+    video = "video"
+
+class OutboxStatus(enum.Enum):
+    pending = "pending"
+    done = "done"
+    failed = "failed"
+
+
+# В списках и поиске по умолчанию только «живые» объекты; условие одно и то же
+# для частичных индексов и запросов (литералом, чтобы планировщик сопоставил их)
+ACTIVE_STATUSES = (PropertyStatus.available, PropertyStatus.price_changed)
+ACTIVE_CONDITION = "status IN ('available', 'price_changed')"
+
 
 # ---------- USER ----------
 class User(Base):
@@ -58,10 +74,173 @@ class Property(Base):
     additions = Column(String)
     price = Column(Numeric)
 
+    # устарело: file_id через запятую, переносится в property_media (см. media.py)
     media_group_id = Column(String)
 
     status = Column(PgEnum(PropertyStatus), default=PropertyStatus.available)
     created_by = Column(BigInteger, ForeignKey("users.tg_id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # растёт при каждом изменении: ключ кэша карточек (render.py) и защита от гонок при UPDATE
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+
+    # пост в канале (см. outbox.py): сообщение с карточкой и медиа [{"message_id", "file_unique_id"}]
+    channel_message_id = Column(BigInteger)
+    channel_media = Column(JSON)
 
     creator = relationship("User", back_populates="properties")
+    media = relationship(
+        "PropertyMedia",
+        order_by="[PropertyMedia.position, PropertyMedia.id]",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        # keyset‑пагинация списков (см. pagination.py)
+        Index("ix_properties_created_at_id", "created_at", "id"),
+        Index("ix_properties_created_by_created_at_id", "created_by", "created_at", "id"),
+        # фильтры /search (см. search_handler.py)
+        Index("ix_properties_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_properties_status_price", "status", "price"),
+        Index("ix_properties_status_bathrooms", "status", "bathrooms"),
+        Index("ix_properties_location_prefix", text("lower(location) text_pattern_ops")).ddl_if(dialect="postgresql"),
+        Index("ix_properties_location_lower", func.lower(location)).ddl_if(dialect="sqlite"),
+        # частичные индексы активных объектов (см. Property.active)
+        Index("ix_properties_active_created_at_id", "created_at", "id",
+              postgresql_where=text(ACTIVE_CONDITION), sqlite_where=text(ACTIVE_CONDITION)),
+        Index("ix_properties_active_created_by", "created_by", "created_at", "id",
+              postgresql_where=text(ACTIVE_CONDITION), sqlite_where=text(ACTIVE_CONDITION)),
+        Index("ix_properties_active_price", "price",
+              postgresql_where=text(ACTIVE_CONDITION), sqlite_where=text(ACTIVE_CONDITION)),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+    @classmethod
+    def active(cls, active: bool = True):
+        """Условие «в продаже»/«архив», совпадающее с предикатом частичных индексов"""
+        condition = f"{cls.__tablename__}.{ACTIVE_CONDITION}"
+        return text(condition if active else f"NOT ({condition})")
+
+
+# ---------- PROPERTY MEDIA ----------
+class PropertyMedia(Base):
+    __tablename__ = "property_media"
+
+    id = Column(Integer, primary_key=True)
+    property_id = Column(Integer, ForeignKey("properties.id", ondelete="CASCADE"), nullable=False)
+    file_id = Column(String, nullable=False)
+    file_unique_id = Column(String, nullable=False)
+    media_type = Column(PgEnum(MediaType), nullable=False)
+    position = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("property_id", "file_unique_id", name="uq_property_media_file"),
+        Index("ix_property_media_property_position", "property_id", "position"),
+    )
+
+
+# ---------- CHANNEL OUTBOX ----------
+class ChannelOutbox(Base):
+    """Задание на публикацию в канал, записывается в одной транзакции с объектом"""
+    __tablename__ = "channel_outbox"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False, default="publish")
+    # без FK: задание должно пережить удаление объекта
+    property_id = Column(Integer)
+    payload = Column(JSON, nullable=False, default=dict)
+
+    status = Column(PgEnum(OutboxStatus), nullable=False, default=OutboxStatus.pending)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index(
+            "ix_channel_outbox_pending", "next_attempt_at", "id",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+    )
+
+
+# ---------- FSM STATE ----------
+class FSMRecord(Base):
+    """Состояние и данные FSM aiogram (см. fsm_storage.py)"""
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)
+    state = Column(String)
+    data = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+# ---------- DASHBOARD COUNTERS ----------
+class StatCounter(Base):
+    """Агрегаты для админ‑дашборда; ведутся триггерами БД (см. counters.py)"""
+    __tablename__ = "stat_counters"
+
+    scope = Column(String, primary_key=True)   # user_role, property_status, property_creator, property_day
+    key = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_stat_counters_scope_value", "scope", "value"),
+    )
+
+
+# ---------- SAVED SEARCHES ----------
+class SavedSearch(Base):
+    """Сохранённый поиск покупателя (см. saved_searches.py); NULL — критерий не задан"""
+    __tablename__ = "saved_searches"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.tg_id", ondelete="CASCADE"), nullable=False)
+    price_min = Column(Numeric)
+    price_max = Column(Numeric)
+    bathrooms = Column(Integer)   # не меньше
+    parking = Column(String)      # в нижнем регистре
+    location = Column(String)     # начало локации, в нижнем регистре
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # интервальный индекс: numrange с NULL‑границей — неограниченный с этой стороны
+        Index("ix_saved_searches_price_range", text("numrange(price_min, price_max, '[]')"),
+              postgresql_using="gist").ddl_if(dialect="postgresql"),
+        Index("ix_saved_searches_price", "price_min", "price_max").ddl_if(dialect="sqlite"),
+        Index("ix_saved_searches_user_id", "user_id", "id"),
+        # иначе numrange в индексе выше падает с DataError без понятной причины
+        CheckConstraint("price_min IS NULL OR price_max IS NULL OR price_min <= price_max",
+                        name="ck_saved_searches_price_order"),
+    )
+
+
+# ---------- PRICE HISTORY ----------
+class PriceHistory(Base):
+    """Изменения цены; пишется триггером БД при INSERT/UPDATE properties (см. market_stats.py)"""
+    __tablename__ = "price_history"
+
+    id = Column(Integer, primary_key=True)
+    property_id = Column(Integer, ForeignKey("properties.id", ondelete="CASCADE"), nullable=False)
+    old_price = Column(Numeric)   # NULL — первая цена объекта
+    new_price = Column(Numeric, nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_price_history_property_changed", "property_id", "changed_at"),
+    )
+
+
+class PriceDaily(Base):
+    """Дневные суммы цен из price_history по локации и комнатам — для тренда в /stats"""
+    __tablename__ = "price_daily"
+
+    location = Column(String, primary_key=True)   # ключ локации, см. counters.LOCATION_KEY
+    rooms = Column(String, primary_key=True)      # '' — не указано
+    day = Column(String, primary_key=True)        # YYYY-MM-DD
+    count = Column(BigInteger, nullable=False, default=0)
+    total = Column(Numeric, nullable=False, default=0)
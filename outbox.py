@@ -0,0 +1,358 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InputMediaVideo
+from sqlalchemy import insert, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import CHANNEL_USERNAME
+from database import AsyncSessionLocal
+from media import ALBUM_LIMIT, album_chunks, input_media, load_media
+from models import ACTIVE_STATUSES, ChannelOutbox, OutboxStatus, Property
+from render import render_card
+from saved_searches import NOTIFY_TITLES, match_subscribers
+from send_scheduler import bulk_priority
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+POLL_INTERVAL = 5.0
+# аренда одного задания; продлевается после каждого отправленного альбома/правки/пачки,
+# поэтому должна покрывать один вызов к каналу: ожидание ведра канала (3 токена при
+# 20/мин — до 9 с) плюс до 3 повторов после 429 с retry_after
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 8
+REMOVED_TEXT = "❌ Объект снят с публикации"
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(5 * 2 ** attempts, 600))
+
+
+# ---------- ENQUEUE ----------
+async def schedule_channel_edits(session: AsyncSession, property_ids):
+    """
+    Запланировать обновление постов в канале (в транзакции хендлера), к выполнению сразу.
+
+    Ожидающее, ещё не взятое задание того же объекта не дублируется: оно и так
+    возьмёт актуальные данные. Задание, уже взятое воркером, имеет next_attempt_at =
+    claim + LEASE и под условие не попадает — для него создаётся новое, чтобы не
+    потерять свежие правки. Для многих объектов сразу — один UPDATE и один INSERT на всю пачку.
+    """
+    property_ids = set(property_ids)
+    if not property_ids:
+        return
+    now = datetime.utcnow()
+    pending = await session.execute(
+        update(ChannelOutbox)
+        .where(
+            ChannelOutbox.kind == "edit",
+            ChannelOutbox.property_id.in_(property_ids),
+            ChannelOutbox.status == OutboxStatus.pending,
+            ChannelOutbox.attempts == 0,
+            ChannelOutbox.next_attempt_at <= now,
+        )
+        .values(next_attempt_at=now)
+        .returning(ChannelOutbox.property_id)
+    )
+    missing = property_ids - set(pending.scalars())
+    if missing:
+        await session.execute(insert(ChannelOutbox), [
+            {"kind": "edit", "property_id": property_id, "next_attempt_at": now, "payload": {}}
+            for property_id in sorted(missing)
+        ])
+
+
+async def schedule_channel_edit(session: AsyncSession, property_id: int):
+    await schedule_channel_edits(session, [property_id])
+
+
+def schedule_channel_delete(session: AsyncSession, property_id: int, message_id, channel_media):
+    """Удалить пост объекта; id сообщений передаются явно — строки объекта к моменту отправки уже нет"""
+    message_ids = [item["message_id"] for item in channel_media or []]
+    if message_id:
+        message_ids.append(message_id)
+    if message_ids:
+        session.add(ChannelOutbox(kind="delete", property_id=property_id,
+                                  payload={"message_id": message_id, "message_ids": message_ids}))
+
+
+class OutboxWorker:
+    """
+    Фоновая публикация в канал. Задания забираются по одному с FOR UPDATE SKIP LOCKED
+    и «арендуются» сдвигом next_attempt_at, поэтому несколько процессов не возьмут
+    одну и ту же запись, а упавший процесс вернёт её в очередь по истечении аренды.
+    Аренда берётся непосредственно перед обработкой и продлевается по ходу долгих
+    заданий: задание, ждущее своей очереди, не может «протухнуть» и уйти другому воркеру.
+    Прогресс (отправленные альбомы) сохраняется в payload, чтобы повтор не дублировал пост.
+    """
+
+    def __init__(self, bot: Bot, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """Разбудить воркер сразу после коммита нового задания"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            try:
+                processed = await self.drain_once()
+            except Exception:
+                logger.exception("Ошибка при обработке outbox")
+                processed = 0
+            if processed >= self.batch_size:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def claim(self) -> Optional[int]:
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            row = (await session.execute(
+                select(ChannelOutbox)
+                .where(ChannelOutbox.status == OutboxStatus.pending, ChannelOutbox.next_attempt_at <= now)
+                .order_by(ChannelOutbox.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+            if row is None:
+                return None
+            row.next_attempt_at = now + LEASE
+            await session.commit()
+            return row.id
+
+    async def drain_once(self) -> int:
+        """До batch_size заданий подряд; каждое арендуется только перед своей обработкой"""
+        processed = 0
+        while processed < self.batch_size:
+            outbox_id = await self.claim()
+            if outbox_id is None:
+                break
+            await self.process(outbox_id)
+            processed += 1
+        return processed
+
+    @staticmethod
+    async def renew_lease(session, row: ChannelOutbox):
+        """Продлить аренду и зафиксировать прогресс задания"""
+        row.next_attempt_at = datetime.utcnow() + LEASE
+        await session.commit()
+
+    async def process(self, outbox_id: int):
+        async with AsyncSessionLocal() as session:
+            row = await session.get(ChannelOutbox, outbox_id)
+            if row is None or row.status != OutboxStatus.pending:
+                return
+            try:
+                with bulk_priority():
+                    await self.handle(session, row)
+                row.status = OutboxStatus.done
+                row.sent_at = datetime.utcnow()
+                row.last_error = None
+                await session.commit()
+                return
+            except Exception as e:
+                error = e
+                # прогресс из payload (отправленные альбомы, получатели) — без обращения к БД:
+                # после ошибки БД транзакция сессии сломана и ленивую загрузку не выполнить
+                payload = inspect(row).dict.get("payload")
+                await session.rollback()
+        await self.record_failure(outbox_id, payload, error)
+
+    async def record_failure(self, outbox_id: int, payload, error: Exception):
+        """Попытка и ошибка пишутся в новой сессии, чтобы задание дошло до MAX_ATTEMPTS при любых сбоях"""
+        async with AsyncSessionLocal() as session:
+            row = await session.get(ChannelOutbox, outbox_id)
+            if row is None:
+                return
+            if payload is not None:
+                row.payload = dict(payload)
+            row.attempts += 1
+            row.last_error = str(error)[:500]
+            if row.attempts >= MAX_ATTEMPTS:
+                row.status = OutboxStatus.failed
+                logger.error("Задание outbox #%s отброшено после %s попыток: %s", row.id, row.attempts, error)
+            else:
+                row.next_attempt_at = datetime.utcnow() + retry_delay(row.attempts)
+                logger.warning("Задание outbox #%s не выполнено (попытка %s): %s", row.id, row.attempts, error)
+            await session.commit()
+
+    # ---------- HANDLERS ----------
+    async def handle(self, session, row: ChannelOutbox):
+        if row.kind == "publish":
+            await self.publish(session, row)
+        elif row.kind == "edit":
+            await self.edit(session, row)
+        elif row.kind == "delete":
+            await self.delete(session, row)
+        elif row.kind == "notify":
+            await self.notify_subscribers(session, row)
+        else:
+            raise ValueError(f"Неизвестный тип задания: {row.kind}")
+
+    async def send_album(self, chunk: list, **kwargs) -> list:
+        if len(chunk) == 1:
+            item = chunk[0]
+            send = self.bot.send_video if isinstance(item, InputMediaVideo) else self.bot.send_photo
+            return [await send(CHANNEL_USERNAME, item.media, **kwargs)]
+        return await self.bot.send_media_group(chat_id=CHANNEL_USERNAME, media=chunk, **kwargs)
+
+    async def save_channel_post(self, session, property_id: int, **values):
+        # Core UPDATE: служебные поля не должны менять version (кэш карточек, конфликты правок)
+        await session.execute(update(Property).where(Property.id == property_id).values(**values))
+        await session.commit()
+
+    async def publish(self, session, row: ChannelOutbox):
+        prop = await session.get(Property, row.property_id)
+        if prop is None:
+            return  # объект удалён до публикации — публиковать нечего
+
+        payload = dict(row.payload or {})
+        # альбомы по 10 штук; номер отправленного альбома сохраняем, чтобы повтор продолжил с места сбоя
+        media = await load_media(session, prop.id)
+        chunks = album_chunks(media)
+        sent_ids = payload.setdefault("media_message_ids", [])
+        for index in range(payload.get("albums_sent", 0), len(chunks)):
+            messages = await self.send_album(chunks[index])
+            sent_ids.extend(m.message_id for m in messages)
+            payload["albums_sent"] = index + 1
+            row.payload = dict(payload)
+            await self.renew_lease(session, row)
+
+        message_text = render_card(prop, "channel")
+        message = await self.bot.send_message(chat_id=CHANNEL_USERNAME, text=message_text, parse_mode="Markdown")
+        payload["message_id"] = message.message_id
+        row.payload = payload
+        await self.save_channel_post(
+            session, prop.id, channel_message_id=message.message_id,
+            channel_media=[{"message_id": message_id, "file_unique_id": item.file_unique_id}
+                           for message_id, item in zip(sent_ids, media)],
+        )
+
+    async def edit(self, session, row: ChannelOutbox):
+        prop = await session.get(Property, row.property_id)
+        if prop is None or prop.channel_message_id is None:
+            return  # удалён или ещё не опубликован — публикация возьмёт актуальные данные
+        await self.sync_media(session, prop, row)
+        try:
+            await self.bot.edit_message_text(chat_id=CHANNEL_USERNAME, message_id=prop.channel_message_id,
+                                             text=render_card(prop, "channel"), parse_mode="Markdown")
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+
+    async def sync_media(self, session, prop: Property, row: ChannelOutbox):
+        """
+        Заменяет изменившиеся медиа (edit_message_media по позициям), лишние удаляет.
+        Альбом в Telegram нельзя дополнить, поэтому новые медиа уходят отдельным
+        альбомом ответом на пост.
+        """
+        media = await load_media(session, prop.id)
+        posted = [dict(item) for item in prop.channel_media or []]
+        changed = False
+        for slot, item in zip(posted, media):
+            if slot["file_unique_id"] != item.file_unique_id:
+                await self.bot.edit_message_media(chat_id=CHANNEL_USERNAME, message_id=slot["message_id"],
+                                                  media=input_media(item))
+                slot["file_unique_id"] = item.file_unique_id
+                changed = True
+                await self.renew_lease(session, row)
+        if len(posted) > len(media):
+            await self.bot.delete_messages(chat_id=CHANNEL_USERNAME,
+                                           message_ids=[slot["message_id"] for slot in posted[len(media):]])
+            del posted[len(media):]
+            changed = True
+        if changed:
+            await self.save_channel_post(session, prop.id, channel_media=posted)
+
+        extra = media[len(posted):]
+        for index, chunk in enumerate(album_chunks(extra)):
+            messages = await self.send_album(chunk, reply_to_message_id=prop.channel_message_id)
+            items = extra[index * ALBUM_LIMIT:]
+            posted.extend({"message_id": m.message_id, "file_unique_id": item.file_unique_id}
+                          for m, item in zip(messages, items))
+            # сохраняем после каждого альбома, чтобы повтор задания не отправил его ещё раз
+            row.next_attempt_at = datetime.utcnow() + LEASE
+            await self.save_channel_post(session, prop.id, channel_media=posted)
+
+    async def delete(self, session, row: ChannelOutbox):
+        payload = row.payload or {}
+        message_id = payload.get("message_id")
+        if message_id:
+            # deleteMessages молча пропускает сообщения, которые удалить нельзя (старше 48 часов),
+            # поэтому карточку удаляем отдельно: deleteMessage сообщает об отказе ошибкой
+            try:
+                await self.bot.delete_message(chat_id=CHANNEL_USERNAME, message_id=message_id)
+            except TelegramBadRequest as e:
+                if "not found" not in str(e):
+                    await self.bot.edit_message_text(chat_id=CHANNEL_USERNAME, message_id=message_id,
+                                                     text=REMOVED_TEXT)
+        media_ids = [item for item in payload.get("message_ids", []) if item != message_id]
+        if media_ids:
+            await self.bot.delete_messages(chat_id=CHANNEL_USERNAME, message_ids=media_ids)
+
+    async def notify_subscribers(self, session, row: ChannelOutbox):
+        """
+        Рассылка подписчикам сохранённых поисков (saved_searches.py) пачками с сохранением
+        прогресса; при сбое отправки payload помнит, кто уже получил уведомление.
+        """
+        prop = await session.get(Property, row.property_id)
+        if prop is None or prop.status not in ACTIVE_STATUSES:
+            return
+        payload = dict(row.payload or {})
+        text = f"{NOTIFY_TITLES.get(payload.get('event'), NOTIFY_TITLES['new'])}\n\n{render_card(prop, 'public')}"
+        while True:
+            users = await match_subscribers(session, prop, after=payload.get("after", 0))
+            if not users:
+                break
+            # темп отправки держит SendScheduler (низкий приоритет — bulk_priority в process)
+            delivered = set(payload.get("delivered", []))
+            todo = [user_id for user_id in users if user_id not in delivered]
+            results = await asyncio.gather(*(self.send_notification(user_id, text) for user_id in todo),
+                                           return_exceptions=True)
+            failed = [user_id for user_id, result in zip(todo, results) if isinstance(result, Exception)]
+            if failed:
+                # курсор — до первого недоставленного, получившие после него запоминаются поимённо:
+                # повтор задания не отправит уведомление второй раз
+                first = failed[0]
+                payload["after"] = max([payload.get("after", 0)] + [user_id for user_id in users if user_id < first])
+                payload["delivered"] = [user_id for user_id in users if user_id > first and user_id not in failed]
+                row.payload = dict(payload)
+                raise next(result for result in results if isinstance(result, Exception))
+            payload["after"] = users[-1]
+            payload.pop("delivered", None)
+            row.payload = dict(payload)
+            # продлеваем аренду: большая рассылка идёт дольше LEASE
+            await self.renew_lease(session, row)
+
+    async def send_notification(self, user_id: int, text: str):
+        try:
+            await self.bot.send_message(chat_id=user_id, text=text, parse_mode="Markdown")
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бот заблокирован или чат недоступен — остальным рассылка продолжается
+            logger.info("Уведомление %s не доставлено: %s", user_id, e)
@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Property
+
+PAGE_SIZE = 8
+CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+@dataclass
+class Page:
+    """Страница объектов, отсортированных от новых к старым по (created_at, id)"""
+    items: List[Property]
+    has_prev: bool
+    has_next: bool
+
+    @property
+    def first_cursor(self) -> str:
+        return encode_cursor(self.items[0]) if self.items else ""
+
+    @property
+    def last_cursor(self) -> str:
+        return encode_cursor(self.items[-1]) if self.items else ""
+
+
+# ---------- CURSOR ----------
+# Курсор помещается в callback_data (лимит Telegram — 64 байта),
+# поэтому кодируем его компактной строкой «<created_at>.<id>».
+def encode_cursor(prop: Property) -> str:
+    return f"{prop.created_at.strftime(CURSOR_FORMAT)}.{prop.id}"
+
+
+def decode_cursor(raw: str) -> Optional[tuple]:
+    if not raw:
+        return None
+    try:
+        created_at, prop_id = raw.split(".")
+        return datetime.strptime(created_at, CURSOR_FORMAT), int(prop_id)
+    except ValueError:
+        return None
+
+
+# ---------- QUERY ----------
+async def fetch_page(
+    session: AsyncSession,
+    *filters,
+    cursor: str = "",
+    direction: str = "next",
+    page_size: int = PAGE_SIZE,
+) -> Page:
+    """
+    Keyset‑пагинация: вместо OFFSET ищем строки строго после/до курсора,
+    поэтому стоимость запроса не зависит от номера страницы и размера таблицы.
+    """
+    key = tuple_(Property.created_at, Property.id)
+    position = decode_cursor(cursor)
+    stmt = select(Property).where(*filters)
+
+    if direction == "prev" and position:
+        stmt = stmt.where(key > position).order_by(Property.created_at.asc(), Property.id.asc())
+    else:
+        if position:
+            stmt = stmt.where(key < position)
+        stmt = stmt.order_by(Property.created_at.desc(), Property.id.desc())
+
+    rows = list((await session.execute(stmt.limit(page_size + 1))).scalars().all())
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if direction == "prev" and position:
+        rows.reverse()
+        return Page(items=rows, has_prev=has_more, has_next=True)
+    return Page(items=rows, has_prev=position is not None, has_next=has_more)
+
+
+# ---------- KEYBOARD ----------
+def page_keyboard(page: Page, open_prefix: str, page_prefix: str, extra_rows: Optional[list] = None) -> InlineKeyboardMarkup:
+    """Кнопки открытия объектов страницы (по 4 в ряд), навигация ◀ ▶ и доп. ряды"""
+    buttons, row = [], []
+    for prop in page.items:
+        row.append(InlineKeyboardButton(text=f"🔎 #{prop.id}", callback_data=f"{open_prefix}{prop.id}"))
+        if len(row) == 4:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+
+    nav = []
+    if page.has_prev:
+        nav.append(InlineKeyboardButton(text="◀", callback_data=f"{page_prefix}prev_{page.first_cursor}"))
+    if page.has_next:
+        nav.append(InlineKeyboardButton(text="▶", callback_data=f"{page_prefix}next_{page.last_cursor}"))
+    if nav:
+        buttons.append(nav)
+    buttons.extend(extra_rows or [])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -0,0 +1,48 @@
+"""
+Прогон записанных апдейтов через локальный webhook‑сервер.
+
+    BOT_MODE=webhook python bot.py
+    python post_updates.py updates.jsonl --url http://127.0.0.1:8080/webhook --concurrency 20
+
+Файл — JSONL, по одному объекту Update из Telegram на строку.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from config import WEBHOOK_SECRET, WEBHOOK_PATH, WEBHOOK_PORT
+from webhook import SECRET_HEADER
+
+
+async def post_updates(path: str, url: str, concurrency: int):
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    headers = {SECRET_HEADER: WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async with aiohttp.ClientSession(headers=headers) as http:
+        async def post(update):
+            async with semaphore:
+                async with http.post(url, json=update) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f"Отправлено {len(updates)} апдейтов за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с)")
+    print("Коды ответов:", statuses)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(post_updates(args.path, args.url, args.concurrency))
@@ -2,11 +2,11 @@ from aiogram import Router, F, types
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from database import AsyncSessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User, UserRole
-from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from config import ADMIN_IDS
+from user_cache import get_user_info, remember_user
 
 router = Router()
 
@@ -16,13 +16,7 @@ class Registration(StatesGroup):
 
 @router.message(F.text == "/start")
 async def start_handler(message: types.Message, state: FSMContext):
-    session = AsyncSessionLocal()
-    stmt = select(User).where(User.tg_id == message.from_user.id)
-    result = await session.execute(stmt)
-    user = result.scalar_one_or_none()
-    await session.close()
-
-    if user:
+    if (await get_user_info(message.from_user.id)).exists:
         await message.answer("👋 С возвращением! Ты уже зарегистрирован.")
     else:
         await message.answer("Привет! Давай зарегистрируемся.\n\nКак тебя зовут?")
@@ -42,7 +36,7 @@ async def get_name(message: types.Message, state: FSMContext):
     await state.set_state(Registration.phone)
 
 @router.message(Registration.phone, F.contact)
-async def get_phone(message: types.Message, state: FSMContext):
+async def get_phone(message: types.Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     name = data["name"]
     phone = message.contact.phone_number
@@ -50,15 +44,14 @@ async def get_phone(message: types.Message, state: FSMContext):
 
     role = UserRole.admin if tg_id in ADMIN_IDS else UserRole.user
 
-    session = AsyncSessionLocal()
     user = User(tg_id=tg_id, name=name, phone=phone, role=role)
     session.add(user)
     try:
         await session.commit()
+        remember_user(tg_id, role)
         await message.answer("✅ Регистрация завершена!", reply_markup=ReplyKeyboardRemove())
     except IntegrityError:
         await session.rollback()
         await message.answer("❌ Ошибка при регистрации.")
     finally:
-        await session.close()
         await state.clear()
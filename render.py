@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from models import Property
+
+CACHE_SIZE = 4096
+
+# ---------- TEMPLATES ----------
+# Все подстановки экранируются escape_md, разметка есть только в самих шаблонах
+_BODY = (
+    "📍 {location}\n"
+    "🛏 {description}\n"
+    "🧱 {condition}\n"
+    "🚗 {parking}\n"
+    "🚽 {bathrooms}\n"
+    "✏ {additions}\n"
+    "💰 *{price}*"
+)
+CARD_TEMPLATES = {
+    "card": "*Объект #{id}* — {status}\n" + _BODY,
+    "admin": "*Объект #{id}* — {status} (создал: `{created_by}`)\n" + _BODY,
+    "channel": "*Объект #{id}* — {status}\n" + _BODY,
+    "public": "*Объект #{id}* — {status}\n" + _BODY,
+    "line": "• *#{id}* 📍 {location} — 💰 {price}",
+    "line_admin": "• *#{id}* 📍 {location} — 💰 {price} (`{created_by}`)",
+    "line_search": "• *#{id}* 📍 {location} — 💰 {price} — 🚽 {bathrooms}",
+}
+PREVIEW_TEMPLATE = "*Предпросмотр:*\n" + _BODY
+
+_MD_SPECIAL = str.maketrans({"_": "\\_", "*": "\\*", "`": "\\`", "[": "\\["})
+
+
+def escape_md(value: Any) -> str:
+    """Экранирование для ParseMode.MARKDOWN (legacy): _ * ` ["""
+    if value is None:
+        return "—"
+    return str(value).translate(_MD_SPECIAL)
+
+
+def _fields(source: Dict[str, Any]) -> Dict[str, str]:
+    return {key: escape_md(value) for key, value in source.items()}
+
+
+def property_fields(prop: Property) -> Dict[str, str]:
+    return _fields({
+        "id": prop.id,
+        "created_by": prop.created_by,
+        "status": prop.status.value if prop.status else None,
+        "location": prop.location,
+        "description": prop.description,
+        "condition": prop.condition,
+        "parking": prop.parking,
+        "bathrooms": prop.bathrooms,
+        "additions": prop.additions,
+        "price": prop.price,
+    })
+
+
+# ---------- CARDS ----------
+# (property_id, version, variant) -> текст; новая версия объекта даёт новый ключ,
+# поэтому явная инвалидация не нужна — старые записи вытесняются LRU
+_cards: "OrderedDict[tuple, str]" = OrderedDict()
+stats = {"hits": 0, "misses": 0}
+
+
+def render_card(prop: Property, variant: str = "card") -> str:
+    key = (prop.id, prop.version, variant)
+    text = _cards.get(key)
+    if text is not None:
+        _cards.move_to_end(key)
+        stats["hits"] += 1
+        return text
+
+    stats["misses"] += 1
+    text = CARD_TEMPLATES[variant].format_map(property_fields(prop))
+    _cards[key] = text
+    if len(_cards) > CACHE_SIZE:
+        _cards.popitem(last=False)
+    return text
+
+
+def render_page(title: str, props, variant: str = "line") -> str:
+    return "\n".join([title, *(render_card(prop, variant) for prop in props)])
+
+
+def render_preview(data: Dict[str, Any]) -> str:
+    """Предпросмотр из FSM‑данных мастера добавления (объекта в БД ещё нет)"""
+    return PREVIEW_TEMPLATE.format_map(_fields({key: data.get(key) for key in (
+        "location", "description", "condition", "parking", "bathrooms", "additions", "price")}))
+
+
+def clear_cache():
+    _cards.clear()
+    property_actions.cache_clear()
+
+
+# ---------- KEYBOARDS ----------
+@lru_cache(maxsize=CACHE_SIZE)
+def property_actions(property_id: int, is_admin: bool = False) -> InlineKeyboardMarkup:
+    # клавиатура зависит только от id и роли, поэтому версия объекта в ключ не входит
+    buttons = [[InlineKeyboardButton(text="✏ Редактировать", callback_data=f"edit_property_{property_id}"),
+                InlineKeyboardButton(text="🏷 Статус", callback_data=f"status_menu_{property_id}")]]
+    if is_admin:
+        buttons.append([InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_property_{property_id}")])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="my_objects" if not is_admin else "admin_properties")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
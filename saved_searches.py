@@ -0,0 +1,106 @@
+"""
+Сохранённые поиски и уведомления о подходящих объектах.
+
+Новый объект (save_object) или новая цена (finish_edit) ставят в outbox задание
+«notify» в той же транзакции. Воркер outbox (outbox.py) подбирает подписчиков
+одним запросом: в PostgreSQL диапазон цены проверяется по GiST‑индексу
+numrange(price_min, price_max) — интервальный индекс, а не перебор подписок в
+Python; остальные критерии — фильтр по уже отобранным строкам. Подписчики идут
+пачками по NOTIFY_BATCH в порядке user_id, последний обработанный сохраняется
+в payload, так что повтор задания продолжает с места сбоя.
+"""
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, literal, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ChannelOutbox, Property, SavedSearch
+from render import escape_md
+
+MAX_SAVED_SEARCHES = 10
+NOTIFY_BATCH = 500
+NOTIFY_TITLES = {
+    "new": "🔔 *Новый объект по вашему поиску*",
+    "price": "🔔 *Изменилась цена объекта по вашему поиску*",
+}
+
+
+# ---------- SAVE ----------
+def search_values(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Критерии подписки из фильтров /search (статус не сохраняется — уведомляем только об активных)"""
+    return {
+        "price_min": Decimal(filters["price_min"]) if filters.get("price_min") else None,
+        "price_max": Decimal(filters["price_max"]) if filters.get("price_max") else None,
+        "bathrooms": filters.get("bathrooms") or None,
+        "parking": filters["parking"].lower() if filters.get("parking") else None,
+        "location": filters["location"].lower() if filters.get("location") else None,
+    }
+
+
+async def save_search(session: AsyncSession, user_id: int, filters: Dict[str, Any]) -> Optional[SavedSearch]:
+    """None — у пользователя уже MAX_SAVED_SEARCHES подписок"""
+    count = (await session.execute(
+        select(func.count()).select_from(SavedSearch).where(SavedSearch.user_id == user_id))).scalar_one()
+    if count >= MAX_SAVED_SEARCHES:
+        return None
+    search = SavedSearch(user_id=user_id, **search_values(filters))
+    session.add(search)
+    await session.flush()
+    return search
+
+
+async def list_searches(session: AsyncSession, user_id: int) -> List[SavedSearch]:
+    return list((await session.execute(
+        select(SavedSearch).where(SavedSearch.user_id == user_id).order_by(SavedSearch.id))).scalars())
+
+
+def describe(search: SavedSearch) -> str:
+    parts = []
+    if search.price_min is not None or search.price_max is not None:
+        parts.append(f"💰 {search.price_min or '…'} – {search.price_max or '…'}")
+    if search.bathrooms:
+        parts.append(f"🚽 от {search.bathrooms}")
+    if search.parking:
+        parts.append(f"🚗 {escape_md(search.parking)}")
+    if search.location:
+        parts.append(f"📍 {escape_md(search.location)}…")
+    return " · ".join(parts) or "любые объекты"
+
+
+# ---------- MATCHING ----------
+def schedule_notify(session: AsyncSession, property_id: int, event: str = "new"):
+    """Задание на рассылку подписчикам; пишется в транзакции, создавшей/изменившей объект"""
+    session.add(ChannelOutbox(kind="notify", property_id=property_id, payload={"event": event}))
+
+
+def match_conditions(dialect: str, prop: Property) -> list:
+    if dialect == "postgresql":
+        price = text("numrange(saved_searches.price_min, saved_searches.price_max, '[]') @> CAST(:price AS numeric)"
+                     ).bindparams(price=prop.price)
+    else:
+        price = and_(or_(SavedSearch.price_min.is_(None), SavedSearch.price_min <= prop.price),
+                     or_(SavedSearch.price_max.is_(None), SavedSearch.price_max >= prop.price))
+    location = (prop.location or "").lower()
+    return [
+        price,
+        or_(SavedSearch.bathrooms.is_(None), SavedSearch.bathrooms <= (prop.bathrooms or 0)),
+        or_(SavedSearch.parking.is_(None), SavedSearch.parking == (prop.parking or "").lower()),
+        # «локация объекта начинается с сохранённой»: префикс сравнивается без LIKE и экранирования
+        or_(SavedSearch.location.is_(None),
+            func.substr(literal(location), 1, func.length(SavedSearch.location)) == SavedSearch.location),
+        SavedSearch.user_id != prop.created_by,
+    ]
+
+
+async def match_subscribers(session: AsyncSession, prop: Property, after: int = 0, limit: int = NOTIFY_BATCH) -> List[int]:
+    """tg_id подписчиков с подходящим поиском (каждый один раз), по возрастанию, после after"""
+    if prop.price is None:
+        return []
+    return list((await session.execute(
+        select(SavedSearch.user_id)
+        .where(*match_conditions(session.bind.dialect.name, prop), SavedSearch.user_id > after)
+        .group_by(SavedSearch.user_id)
+        .order_by(SavedSearch.user_id)
+        .limit(limit)
+    )).scalars())
@@ -0,0 +1,347 @@
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List
+
+from aiogram import Router, F, types
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_middleware import read_only
+from fulltext import MIN_QUERY_LENGTH, find_properties
+from models import Property, PropertyStatus, SavedSearch
+from pagination import PAGE_SIZE, Page, fetch_page, page_keyboard
+from render import escape_md, render_card, render_page
+from saved_searches import MAX_SAVED_SEARCHES, describe, list_searches, save_search
+from states import Search
+from user_cache import get_user_info
+
+router = Router()
+
+PARKING_OPTIONS = ["Подземный", "Наземный", "Нет"]
+
+
+# ---------- FILTERS ----------
+def build_filters(filters: Dict[str, Any]) -> List:
+    """Условия WHERE по фильтрам поиска; каждое покрывается индексом из models.Property"""
+    conditions = []
+    if filters.get("price_min") is not None:
+        conditions.append(Property.price >= Decimal(filters["price_min"]))
+    if filters.get("price_max") is not None:
+        conditions.append(Property.price <= Decimal(filters["price_max"]))
+    if filters.get("bathrooms"):
+        conditions.append(Property.bathrooms >= filters["bathrooms"])
+    if filters.get("parking"):
+        conditions.append(func.lower(Property.parking) == filters["parking"].lower())
+    if filters.get("status"):
+        conditions.append(Property.status == PropertyStatus[filters["status"]])
+    else:
+        # без явного статуса — только активные объекты (частичные индексы)
+        conditions.append(Property.active())
+    if filters.get("location"):
+        # префиксный LIKE по lower(location) использует индекс text_pattern_ops
+        pattern = filters["location"].lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(func.lower(Property.location).like(pattern + "%", escape="\\"))
+    return conditions
+
+
+def parse_price_range(text: str):
+    """«50000-120000», «-120000», «50000-» или одно число (верхняя граница)"""
+    text = text.replace(" ", "")
+    low, sep, high = text.partition("-")
+    if not sep:
+        low, high = "", low
+    try:
+        price_min = Decimal(low) if low else None
+        price_max = Decimal(high) if high else None
+    except InvalidOperation:
+        raise ValueError(text)
+    if price_min is not None and price_max is not None and price_min > price_max:
+        # «5000000-100000» — перепутанные границы; numrange с такими границами не создать
+        price_min, price_max = price_max, price_min
+    return (str(price_min) if price_min is not None else None,
+            str(price_max) if price_max is not None else None)
+
+
+def filters_text(filters: Dict[str, Any]) -> str:
+    price = "любая"
+    if filters.get("price_min") or filters.get("price_max"):
+        price = f"{filters.get('price_min') or '…'} – {filters.get('price_max') or '…'}"
+    status = PropertyStatus[filters["status"]].value if filters.get("status") else "активные"
+    return (
+        "🔎 *Поиск объектов*\n"
+        f"💰 Цена: {price}\n"
+        f"🚽 Санузлов от: {filters.get('bathrooms') or 'любое'}\n"
+        f"🚗 Парковка: {filters.get('parking') or 'любая'}\n"
+        f"🏷 Статус: {status}\n"
+        f"📍 Локация: {escape_md(filters.get('location')) if filters.get('location') else 'любая'}"
+    )
+
+
+def filters_menu() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💰 Цена", callback_data="search_price"),
+         InlineKeyboardButton(text="🚽 Санузлы", callback_data="search_bath")],
+        [InlineKeyboardButton(text="🚗 Парковка", callback_data="search_parking"),
+         InlineKeyboardButton(text="🏷 Статус", callback_data="search_status")],
+        [InlineKeyboardButton(text="📍 Локация", callback_data="search_location")],
+        [InlineKeyboardButton(text="🔎 Показать", callback_data="search_run"),
+         InlineKeyboardButton(text="♻ Сбросить", callback_data="search_reset")],
+        [InlineKeyboardButton(text="🔔 Уведомлять о новых", callback_data="search_save")],
+    ])
+
+
+def choice_keyboard(prefix: str, options: List[tuple]) -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(text=label, callback_data=f"{prefix}{value}")] for label, value in options]
+    rows.append([InlineKeyboardButton(text="Любой", callback_data=f"{prefix}any")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def get_filters(state: FSMContext) -> Dict[str, Any]:
+    return (await state.get_data()).get("search", {})
+
+
+async def set_filter(state: FSMContext, **values):
+    filters = await get_filters(state)
+    for key, value in values.items():
+        if value in (None, "any"):
+            filters.pop(key, None)
+        else:
+            filters[key] = value
+    await state.update_data(search=filters)
+    return filters
+
+
+# ---------- MENU ----------
+@router.message(F.text == "/search")
+async def cmd_search(message: types.Message, state: FSMContext):
+    await state.set_state(None)
+    await message.answer(filters_text(await get_filters(state)), parse_mode="Markdown", reply_markup=filters_menu())
+
+
+@router.callback_query(F.data == "search_back")
+async def search_back(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await callback.message.edit_text(filters_text(await get_filters(state)), parse_mode="Markdown",
+                                     reply_markup=filters_menu())
+
+
+@router.callback_query(F.data == "search_reset")
+async def search_reset(callback: types.CallbackQuery, state: FSMContext):
+    await state.update_data(search={})
+    await search_back(callback, state)
+
+
+# ---------- FILTER INPUT ----------
+@router.callback_query(F.data == "search_price")
+async def search_price(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(Search.price)
+    await callback.answer()
+    await callback.message.answer("💰 Введите диапазон цены, например `50000-120000`, `-120000` или `50000-`:",
+                                  parse_mode="Markdown")
+
+
+@router.message(Search.price)
+async def search_price_value(message: types.Message, state: FSMContext):
+    try:
+        price_min, price_max = parse_price_range(message.text or "")
+    except ValueError:
+        await message.answer("❌ Не понял диапазон. Пример: `50000-120000`", parse_mode="Markdown")
+        return
+    await state.set_state(None)
+    filters = await set_filter(state, price_min=price_min, price_max=price_max)
+    await message.answer(filters_text(filters), parse_mode="Markdown", reply_markup=filters_menu())
+
+
+@router.callback_query(F.data == "search_location")
+async def search_location(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(Search.location)
+    await callback.answer()
+    await callback.message.answer("📍 Введите начало названия локации (или «-», чтобы сбросить):")
+
+
+@router.message(Search.location)
+async def search_location_value(message: types.Message, state: FSMContext):
+    text = (message.text or "").strip()
+    await state.set_state(None)
+    filters = await set_filter(state, location=None if text in ("", "-") else text)
+    await message.answer(filters_text(filters), parse_mode="Markdown", reply_markup=filters_menu())
+
+
+@router.callback_query(F.data == "search_bath")
+async def search_bath(callback: types.CallbackQuery):
+    await callback.answer()
+    await callback.message.edit_reply_markup(
+        reply_markup=choice_keyboard("search_set_bathrooms_", [("1+", 1), ("2+", 2), ("3+", 3)]))
+
+
+@router.callback_query(F.data == "search_parking")
+async def search_parking(callback: types.CallbackQuery):
+    await callback.answer()
+    await callback.message.edit_reply_markup(
+        reply_markup=choice_keyboard("search_set_parking_", [(p, p) for p in PARKING_OPTIONS]))
+
+
+@router.callback_query(F.data == "search_status")
+async def search_status(callback: types.CallbackQuery):
+    await callback.answer()
+    await callback.message.edit_reply_markup(
+        reply_markup=choice_keyboard("search_set_status_", [(s.value, s.name) for s in PropertyStatus]))
+
+
+@router.callback_query(F.data.startswith("search_set_"))
+async def search_set(callback: types.CallbackQuery, state: FSMContext):
+    _, _, field, value = callback.data.split("_", 3)
+    if field == "bathrooms" and value != "any":
+        value = int(value)
+    filters = await set_filter(state, **{field: value})
+    await callback.answer()
+    await callback.message.edit_text(filters_text(filters), parse_mode="Markdown", reply_markup=filters_menu())
+
+
+# ---------- RESULTS ----------
+async def show_results(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession,
+                       cursor: str = "", direction: str = "next"):
+    filters = await get_filters(state)
+    page = await fetch_page(session, *build_filters(filters), cursor=cursor, direction=direction)
+
+    await callback.answer()
+    back = [[InlineKeyboardButton(text="🔙 К фильтрам", callback_data="search_back")]]
+    if not page.items and not page.has_prev:
+        await callback.message.edit_text("🙁 Ничего не найдено.", reply_markup=InlineKeyboardMarkup(inline_keyboard=back))
+        return
+    text = render_page("🔎 *Результаты поиска:*", page.items, "line_search")
+    await callback.message.edit_text(text, parse_mode="Markdown",
+                                     reply_markup=page_keyboard(page, "search_open_", "search_page_", back))
+
+
+@router.callback_query(F.data == "search_run")
+@read_only
+async def search_run(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    await show_results(callback, state, session)
+
+
+@router.callback_query(F.data.startswith("search_page_"))
+@read_only
+async def search_page(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    _, _, direction, cursor = callback.data.split("_", 3)
+    await show_results(callback, state, session, cursor, direction)
+
+
+@router.callback_query(F.data.startswith("search_open_"))
+@read_only
+async def search_open(callback: types.CallbackQuery, session: AsyncSession):
+    property_id = int(callback.data.split("_")[-1])
+    prop = await session.get(Property, property_id)
+
+    await callback.answer()
+    back = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 К результатам", callback_data="search_run")]])
+    if not prop:
+        await callback.message.edit_text("❌ Объект не найден.", reply_markup=back)
+        return
+    text = render_card(prop, "public")
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=back)
+
+
+# ---------- SAVED SEARCHES ----------
+@router.callback_query(F.data == "search_save")
+async def search_save(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    if not (await get_user_info(callback.from_user.id)).exists:
+        await callback.answer("Сначала зарегистрируйтесь: /start", show_alert=True)
+        return
+    search = await save_search(session, callback.from_user.id, await get_filters(state))
+    if search is None:
+        await callback.answer(f"❌ Не больше {MAX_SAVED_SEARCHES} подписок — удалите лишние в /subscriptions",
+                              show_alert=True)
+        return
+    await session.commit()
+    await callback.answer("🔔 Поиск сохранён: пришлём новые объекты и изменения цены. Список — /subscriptions",
+                          show_alert=True)
+
+
+def subscriptions_view(searches) -> tuple:
+    if not searches:
+        return "🔕 Сохранённых поисков нет. Настройте фильтры в /search и нажмите «🔔 Уведомлять о новых».", None
+    lines = ["🔔 *Сохранённые поиски:*"] + [f"{n}. {describe(s)}" for n, s in enumerate(searches, 1)]
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"❌ Удалить {n}", callback_data=f"saved_del_{s.id}")]
+        for n, s in enumerate(searches, 1)
+    ])
+    return "\n".join(lines), kb
+
+
+@router.message(F.text == "/subscriptions")
+@read_only
+async def cmd_subscriptions(message: types.Message, session: AsyncSession):
+    text, kb = subscriptions_view(await list_searches(session, message.from_user.id))
+    await message.answer(text, parse_mode="Markdown", reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith("saved_del_"))
+async def saved_delete(callback: types.CallbackQuery, session: AsyncSession):
+    await session.execute(delete(SavedSearch).where(
+        SavedSearch.id == int(callback.data.split("_")[-1]), SavedSearch.user_id == callback.from_user.id))
+    await session.commit()
+    await callback.answer("Удалено")
+    text, kb = subscriptions_view(await list_searches(session, callback.from_user.id))
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=kb)
+
+
+# ---------- FULL-TEXT (/find) ----------
+# запрос, смещение и режим поиска (fulltext.find_properties) — в FSM‑данных («find»):
+# текст не помещается в callback_data
+async def show_found(target: types.Message, session: AsyncSession, find: Dict[str, Any], edit: bool):
+    query, offset = find["query"], find["offset"]
+    props, has_next, find["mode"] = await find_properties(session, query, offset, PAGE_SIZE, find.get("mode"))
+    if not props and not offset:
+        text, markup = f"🙁 По запросу «{escape_md(query)}» ничего не найдено.", None
+    else:
+        nav = []
+        if offset:
+            nav.append(InlineKeyboardButton(text="◀", callback_data=f"find_page_{max(offset - PAGE_SIZE, 0)}"))
+        if has_next:
+            nav.append(InlineKeyboardButton(text="▶", callback_data=f"find_page_{offset + PAGE_SIZE}"))
+        text = render_page(f"🔎 *Найдено по запросу «{escape_md(query)}»:*", props, "line_search")
+        markup = page_keyboard(Page(props, False, False), "find_open_", "", [nav] if nav else None)
+    if edit:
+        await target.edit_text(text, parse_mode="Markdown", reply_markup=markup)
+    else:
+        await target.answer(text, parse_mode="Markdown", reply_markup=markup)
+
+
+@router.message(F.text.startswith("/find"))
+@read_only
+async def cmd_find(message: types.Message, state: FSMContext, session: AsyncSession):
+    query = message.text.partition(" ")[2].strip()
+    if len(query) < MIN_QUERY_LENGTH:
+        await message.answer("🔎 Напишите, что искать: `/find евроремонт у метро`", parse_mode="Markdown")
+        return
+    find = {"query": query, "offset": 0}
+    await show_found(message, session, find, edit=False)
+    await state.update_data(find=find)
+
+
+@router.callback_query(F.data.startswith("find_page_") | (F.data == "find_back"))
+@read_only
+async def find_page(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    find = (await state.get_data()).get("find")
+    await callback.answer()
+    if not find:
+        await callback.message.edit_text("⌛ Поиск устарел, повторите /find.")
+        return
+    if callback.data != "find_back":
+        find["offset"] = int(callback.data.split("_")[-1])
+        await state.update_data(find=find)
+    await show_found(callback.message, session, find, edit=True)
+
+
+@router.callback_query(F.data.startswith("find_open_"))
+@read_only
+async def find_open(callback: types.CallbackQuery, session: AsyncSession):
+    prop = await session.get(Property, int(callback.data.split("_")[-1]))
+    await callback.answer()
+    back = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 К результатам", callback_data="find_back")]])
+    if not prop:
+        await callback.message.edit_text("❌ Объект не найден.", reply_markup=back)
+        return
+    await callback.message.edit_text(render_card(prop, "public"), parse_mode="Markdown", reply_markup=back)
@@ -0,0 +1,199 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMediaGroup
+from aiogram.methods.base import Response, TelegramMethod, TelegramType
+
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHANNEL_RATE_PER_MIN
+
+logger = logging.getLogger(__name__)
+
+# ---------- PRIORITIES ----------
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+MAX_TRACKED_CHATS = 10000   # дальше забываем чаты с полными (простаивающими) вёдрами
+
+send_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    """Все вызовы Bot API внутри блока уступают очередь интерактивным ответам"""
+    token = send_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+# ---------- TOKEN BUCKET ----------
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберётся cost токенов"""
+        now = time.monotonic()
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < cost:
+            wait = max(wait, (cost - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, cost: float):
+        self.tokens -= min(cost, self.capacity)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# ---------- SCHEDULER ----------
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: каждый исходящий вызов с chat_id сначала
+    проходит через ведро своего чата, затем через общее ведро с приоритетами.
+    Ответ 429 (retry_after) блокирует ведро чата и повторяет запрос.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = SEND_GLOBAL_RATE,
+        chat_rate: float = SEND_CHAT_RATE,
+        channel_rate_per_min: float = SEND_CHANNEL_RATE_PER_MIN,
+        max_retries: int = 3,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.channel_rate = channel_rate_per_min / 60
+        self.max_retries = max_retries
+
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._chat_locks: Dict[Union[int, str], asyncio.Lock] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.retried = 0
+        self.waiting_chat = 0
+
+    # --- очереди ---
+    @staticmethod
+    def is_channel(chat_id: Union[int, str]) -> bool:
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_TRACKED_CHATS:
+                self._forget_idle()
+            if self.is_channel(chat_id):
+                bucket = TokenBucket(self.channel_rate, 3)
+            else:
+                bucket = TokenBucket(self.chat_rate, 3)
+            self._chat_buckets[chat_id] = bucket
+            self._chat_locks[chat_id] = asyncio.Lock()
+        return bucket
+
+    def _forget_idle(self):
+        # полное ведро без блокировки 429 и свободный замок — состояние чата можно забыть
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                if bucket.delay(bucket.capacity) == 0 and not self._chat_locks[chat_id].locked()]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+            del self._chat_locks[chat_id]
+
+    async def _acquire_chat(self, chat_id: Union[int, str], cost: float):
+        bucket = self._chat_bucket(chat_id)
+        self.waiting_chat += 1
+        try:
+            async with self._chat_locks[chat_id]:
+                while (wait := bucket.delay(cost)) > 0:
+                    await asyncio.sleep(wait)
+                bucket.consume(cost)
+        finally:
+            self.waiting_chat -= 1
+
+    async def _acquire_global(self, cost: float, priority: int):
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.create_task(self._pump())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), cost, future))
+        self._wakeup.set()
+        await future
+
+    async def _pump(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, _, cost, future = self._heap[0]
+            if future.done():  # ожидающий отменён
+                heapq.heappop(self._heap)
+                continue
+            wait = self.global_bucket.delay(cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._heap)
+            self.global_bucket.consume(cost)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_global": len(self._heap),
+            "queued_chat": self.waiting_chat,
+            "tracked_chats": len(self._chat_buckets),
+            "sent": self.sent,
+            "retried": self.retried,
+        }
+
+    # --- middleware ---
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        priority = send_priority.get()
+        attempt = 0
+        while True:
+            await self._acquire_chat(chat_id, cost)
+            await self._acquire_global(cost, priority)
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retried += 1
+                logger.warning("429 для чата %s, повтор через %s с (попытка %s)", chat_id, e.retry_after, attempt)
+                self._chat_bucket(chat_id).block(e.retry_after)
+                if attempt > self.max_retries:
+                    raise
@@ -14,3 +14,7 @@ class AddProperty(StatesGroup):
 class EditProperty(StatesGroup):
     field = State()
     value = State()
+
+class Search(StatesGroup):
+    price = State()
+    location = State()
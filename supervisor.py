@@ -0,0 +1,215 @@
+"""
+Многопроцессный режим: supervisor получает апдейты (polling или webhook, см. BOT_MODE)
+и раздаёт их WORKERS процессам по хэшу чата/пользователя, поэтому порядок апдейтов
+одного пользователя и его FSM сохраняются. Каждый воркер — обычный dp из bot.py.
+
+    WORKERS=4 python supervisor.py
+
+Метрики (METRICS_PORT) отдаёт каждый воркер на своём порту: воркер i слушает
+METRICS_PORT + i, поэтому в Prometheus — WORKERS целей
+METRICS_HOST:METRICS_PORT … METRICS_HOST:METRICS_PORT+WORKERS-1. Сам supervisor /metrics не отдаёт.
+"""
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import time
+from typing import Any, Dict, List
+
+from aiogram import Bot
+
+from config import (
+    BOT_TOKEN, BOT_MODE, WORKERS, DB_POOL_SIZE, DB_MAX_OVERFLOW, SEND_GLOBAL_RATE, SEND_CHANNEL_RATE_PER_MIN,
+    METRICS_PORT,
+)
+from webhook import ChatOrderedExecutor, routing_key, serve
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 30.0
+MONITOR_INTERVAL = 2.0
+POLL_TIMEOUT = 30
+
+
+# ---------- WORKER ----------
+def worker_main(index: int, updates: mp.Queue, heartbeat):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # останавливает supervisor через sentinel в очереди
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_worker(index, updates, heartbeat))
+
+
+async def _worker(index: int, updates: mp.Queue, heartbeat):
+    from bot import dp, bot  # импорт внутри процесса: свой loop, свой пул соединений
+
+    executor = ChatOrderedExecutor(lambda update: dp.feed_raw_update(bot, update))
+    loop = asyncio.get_running_loop()
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    beat_task = asyncio.create_task(beat())
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        while True:
+            try:
+                update = await loop.run_in_executor(None, updates.get, True, HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                continue
+            if update is None:  # сигнал остановки от supervisor
+                break
+            executor.submit(routing_key(update), update)
+    finally:
+        await executor.drain()
+        beat_task.cancel()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+# ---------- SUPERVISOR ----------
+class Supervisor:
+    """Запускает воркеры, маршрутизирует апдейты и перезапускает упавшие процессы"""
+
+    def __init__(self, workers: int = WORKERS):
+        self.ctx = mp.get_context("spawn")
+        self.size = workers
+        self.queues: List[mp.Queue] = [self.ctx.Queue() for _ in range(workers)]
+        self.heartbeats = [self.ctx.Value("d", 0.0) for _ in range(workers)]
+        self.processes: List[Any] = [None] * workers
+        self.accepting = True
+        self.routed = 0
+        self.restarts = 0
+
+    # --- процессы ---
+    def start_worker(self, index: int):
+        self.heartbeats[index].value = time.time()
+        if METRICS_PORT:
+            # spawn копирует окружение в момент start(): у каждого воркера свой порт метрик
+            os.environ["METRICS_PORT"] = str(METRICS_PORT + index)
+        process = self.ctx.Process(
+            target=worker_main,
+            args=(index, self.queues[index], self.heartbeats[index]),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info("Воркер %s запущен (pid %s)", index, process.pid)
+
+    def start(self):
+        # общий лимит соединений делим между воркерами, чтобы не выбрать весь пул Postgres
+        os.environ["DB_POOL_SIZE"] = str(max(1, DB_POOL_SIZE // self.size))
+        os.environ["DB_MAX_OVERFLOW"] = str(max(0, DB_MAX_OVERFLOW // self.size))
+        # лимиты Telegram — на бота и на канал, а SendScheduler свой в каждом воркере:
+        # делим так же. SEND_CHAT_RATE не делим — личный чат целиком обслуживает один воркер
+        os.environ["SEND_GLOBAL_RATE"] = str(SEND_GLOBAL_RATE / self.size)
+        os.environ["SEND_CHANNEL_RATE_PER_MIN"] = str(SEND_CHANNEL_RATE_PER_MIN / self.size)
+        for index in range(self.size):
+            self.start_worker(index)
+
+    def healthy(self, index: int) -> bool:
+        process = self.processes[index]
+        return (process is not None and process.is_alive()
+                and time.time() - self.heartbeats[index].value < HEARTBEAT_TIMEOUT)
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            if not self.accepting:  # идёт остановка — воркеры завершаются штатно
+                return
+            for index in range(self.size):
+                if self.healthy(index):
+                    continue
+                process = self.processes[index]
+                logger.warning("Воркер %s не отвечает (exitcode=%s), перезапуск", index, process.exitcode)
+                if process.is_alive():
+                    process.kill()
+                    process.join(5)
+                self.restarts += 1
+                self.start_worker(index)
+
+    async def stop(self, timeout: float = 30):
+        self.accepting = False
+        for q in self.queues:
+            q.put(None)
+        deadline = time.time() + timeout
+        for process in self.processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.join, max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.kill()
+
+    # --- маршрутизация (интерфейс как у ChatOrderedExecutor для webhook.create_app) ---
+    @property
+    def pending(self) -> int:
+        return 0  # очередь воркера ограничивает сам воркер
+
+    def submit(self, key: int, update: Dict[str, Any]):
+        self.queues[key % self.size].put(update)
+        self.routed += 1
+
+    async def drain(self, timeout: float = 30) -> bool:
+        await self.stop(timeout)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.size,
+            "alive": sum(self.healthy(i) for i in range(self.size)),
+            "routed": self.routed,
+            "restarts": self.restarts,
+        }
+
+
+async def poll(supervisor: Supervisor, bot: Bot, stop: asyncio.Event):
+    await bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except Exception:
+            logger.exception("Ошибка getUpdates")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            raw = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+            supervisor.submit(routing_key(raw), raw)
+            offset = update.update_id + 1
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    supervisor = Supervisor()
+    supervisor.start()
+    monitor_task = asyncio.create_task(supervisor.monitor())
+    bot = Bot(token=BOT_TOKEN)
+
+    try:
+        if BOT_MODE == "webhook":
+            # webhook регистрирует/обслуживает supervisor, воркеры только обрабатывают
+            from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+
+            async def register_webhook():
+                if WEBHOOK_URL:
+                    await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None)
+
+            await serve(supervisor, on_started=register_webhook)
+        else:
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            poll_task = asyncio.create_task(poll(supervisor, bot, stop))
+            await stop.wait()
+            poll_task.cancel()
+            await supervisor.stop()
+    finally:
+        monitor_task.cancel()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
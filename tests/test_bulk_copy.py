@@ -0,0 +1,23 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from bulk_handler import IMPORT_COLUMNS, copy_records, parse_row  # noqa: E402
+
+# типы, которые кодеки asyncpg принимают для колонок properties при COPY
+COPY_TYPES = (str, int, Decimal, datetime, type(None))
+
+
+def test_copy_records_are_primitive():
+    now = datetime(2026, 1, 1)
+    row = parse_row({"location": "Юнусабад", "price": "90 100", "status": "продано", "bathrooms": "2"}, 7, now)
+    (record,) = copy_records([row])
+
+    assert len(record) == len(IMPORT_COLUMNS)
+    assert all(isinstance(value, COPY_TYPES) for value in record)
+    values = dict(zip(IMPORT_COLUMNS, record))
+    assert values["status"] == row["status"].name
+    assert values["price"] == Decimal("90100")
+    assert values["created_by"] == 7
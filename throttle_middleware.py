@@ -0,0 +1,143 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import THROTTLE_ENABLED
+from send_scheduler import TokenBucket
+from user_cache import cached_is_admin
+
+logger = logging.getLogger(__name__)
+
+# вид апдейта -> (токенов в секунду, ёмкость ведра); ёмкость media покрывает альбом из 10 файлов
+THROTTLE_RATES = {
+    "command": (1.0, 5),
+    "callback": (3.0, 10),
+    "media": (5.0, 30),
+    "message": (2.0, 10),
+    "inline": (5.0, 15),
+}
+DUPLICATE_WINDOW = 1.0      # сек: повторное нажатие той же кнопки того же сообщения — дубль
+MAX_TRACKED_USERS = 10000   # дальше забываем пользователей с полными (простаивающими) вёдрами
+THROTTLED_ANSWER = "⏳ Слишком часто, подождите секунду"
+
+
+def update_kind(update: Update) -> Optional[str]:
+    if update.message:
+        message = update.message
+        if message.photo or message.video or message.document:
+            return "media"
+        if message.text and message.text.startswith("/"):
+            return "command"
+        return "message"
+    if update.callback_query:
+        return "callback"
+    if update.inline_query:
+        return "inline"
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer middleware на dp.update: срабатывает раньше DbSessionMiddleware, поэтому
+    отброшенный апдейт не открывает сессию хендлера. Встроенный FSMContextMiddleware
+    aiogram регистрируется в Dispatcher раньше любых пользовательских outer‑middleware,
+    так что чтение состояния (SQLStorage.get_state) происходит и для отброшенных апдейтов.
+    У каждого пользователя своё ведро на каждый вид апдейтов (THROTTLE_RATES).
+    Повторные нажатия той же кнопки, пока первое обрабатывается или в течение
+    DUPLICATE_WINDOW, схлопываются: хендлер вызывается один раз. Отброшенным
+    callback отвечаем (иначе у клиента крутится индикатор), сообщения молча теряем.
+    Админы (роль в БД) не ограничиваются; роль берётся только из кэша user_cache —
+    поток апдейтов от незнакомых пользователей не должен ходить в БД через этот middleware.
+    Админ, которого нет в кэше, ограничивается до первого же хендлера, загрузившего роль.
+    """
+
+    def __init__(self, rates: Dict[str, Tuple[float, float]] = None, duplicate_window: float = DUPLICATE_WINDOW):
+        self.rates = rates or THROTTLE_RATES
+        self.duplicate_window = duplicate_window
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._inflight: set = set()
+        self._recent: Dict[Tuple, float] = {}
+        self.passed = 0
+        self.dropped: Dict[str, int] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        kind = update_kind(event)
+        if user is None or kind is None or cached_is_admin(user.id):
+            return await handler(event, data)
+
+        tap = None
+        if kind == "callback":
+            query = event.callback_query
+            tap = (user.id, query.data, query.message.message_id if query.message else query.inline_message_id)
+            if tap in self._inflight or time.monotonic() - self._recent.get(tap, float("-inf")) < self.duplicate_window:
+                return await self._drop(event, kind, "duplicate")
+
+        if not self._take(user.id, kind):
+            return await self._drop(event, kind, "rate")
+
+        self.passed += 1
+        if tap is None:
+            return await handler(event, data)
+        self._inflight.add(tap)
+        try:
+            return await handler(event, data)
+        finally:
+            self._inflight.discard(tap)
+            self._recent[tap] = time.monotonic()
+            if len(self._recent) > MAX_TRACKED_USERS:
+                self._forget_taps()
+
+    # --- вёдра ---
+    def _take(self, user_id: int, kind: str) -> bool:
+        key = (user_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._forget_idle()
+            rate, capacity = self.rates[kind]
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+        if bucket.delay(1) > 0:
+            return False
+        bucket.consume(1)
+        return True
+
+    def _forget_idle(self):
+        # delay(capacity) == 0 — ведро снова полное, состояние пользователя можно забыть
+        for key in [key for key, bucket in self._buckets.items() if bucket.delay(bucket.capacity) == 0]:
+            del self._buckets[key]
+
+    def _forget_taps(self):
+        expired = time.monotonic() - self.duplicate_window
+        for tap in [tap for tap, finished in self._recent.items() if finished < expired]:
+            del self._recent[tap]
+
+    # --- отброшенные ---
+    async def _drop(self, event: Update, kind: str, reason: str):
+        name = f"{kind}_{reason}"
+        self.dropped[name] = self.dropped.get(name, 0) + 1
+        logger.debug("Апдейт %s отброшен: %s", event.update_id, name)
+        if kind == "callback":
+            # дубль нажатия — без текста, превышение лимита — короткая подсказка
+            await event.callback_query.answer(THROTTLED_ANSWER if reason == "rate" else None)
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"passed": self.passed, **{f"dropped_{name}": count for name, count in self.dropped.items()}}
+
+
+def setup_throttling(dp) -> Optional[ThrottlingMiddleware]:
+    """Регистрирует middleware первым outer‑middleware апдейтов; None, если выключено"""
+    if not THROTTLE_ENABLED:
+        return None
+    middleware = ThrottlingMiddleware()
+    dp.update.outer_middleware(middleware)
+    return middleware
@@ -0,0 +1,97 @@
+"""
+Кэш пользователей tg_id -> роль.
+
+Кэш свой в каждом процессе (supervisor.py запускает несколько воркеров), поэтому смена
+роли (change_user_role) увеличивает версию ролей в stat_counters (scope «cache_version»).
+Каждый процесс сверяет версию не чаще раза в USER_ROLE_POLL секунд и при изменении
+сбрасывает кэш целиком: другие воркеры видят новую роль не позже чем через USER_ROLE_POLL.
+"""
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from cache import AsyncTTLCache
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_ROLE_POLL
+from database import AsyncSessionLocal, insert_for
+from models import StatCounter, User, UserRole
+
+ROLES_VERSION = ("cache_version", "user_roles")  # (scope, key) в stat_counters
+
+
+@dataclass(frozen=True)
+class UserInfo:
+    exists: bool
+    role: Optional[UserRole] = None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == UserRole.admin
+
+
+# tg_id -> UserInfo; отрицательный ответ тоже кэшируется и сбрасывается при регистрации
+user_cache = AsyncTTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+async def _load_user(tg_id: int) -> UserInfo:
+    async with AsyncSessionLocal() as session:
+        role = (await session.execute(select(User.role).where(User.tg_id == tg_id))).scalar_one_or_none()
+    return UserInfo(exists=role is not None, role=role)
+
+
+_roles_version: Optional[int] = None
+_roles_checked_at = float("-inf")
+
+
+async def _sync_roles_version():
+    """Сбросить кэш, если роли меняли в другом процессе; один запрос на USER_ROLE_POLL"""
+    global _roles_version, _roles_checked_at
+    now = time.monotonic()
+    if now - _roles_checked_at < USER_ROLE_POLL:
+        return
+    _roles_checked_at = now  # до await: одновременные вызовы не повторяют запрос
+    scope, key = ROLES_VERSION
+    async with AsyncSessionLocal() as session:
+        version = (await session.execute(select(StatCounter.value).where(
+            StatCounter.scope == scope, StatCounter.key == key))).scalar_one_or_none() or 0
+    if _roles_version is not None and version != _roles_version:
+        user_cache.clear()
+    _roles_version = version
+
+
+async def get_user_info(tg_id: int) -> UserInfo:
+    await _sync_roles_version()
+    return await user_cache.get_or_load(tg_id, lambda: _load_user(tg_id))
+
+
+async def is_admin(tg_id: int) -> bool:
+    return (await get_user_info(tg_id)).is_admin
+
+
+def cached_is_admin(tg_id: int) -> bool:
+    """Только по кэшу, без запроса к БД: промах — не админ"""
+    info = user_cache.peek(tg_id)
+    return info is not None and info.is_admin
+
+
+def remember_user(tg_id: int, role: UserRole):
+    """Вызывать после успешной регистрации"""
+    user_cache.set(tg_id, UserInfo(exists=True, role=role))
+
+
+def invalidate_user(tg_id: int):
+    user_cache.invalidate(tg_id)
+
+
+async def change_user_role(tg_id: int, role: UserRole) -> bool:
+    scope, key = ROLES_VERSION
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(update(User).where(User.tg_id == tg_id).values(role=role))
+        insert = insert_for(session)
+        stmt = insert(StatCounter).values(scope=scope, key=key, value=1)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[StatCounter.scope, StatCounter.key], set_={"value": StatCounter.value + 1}))
+        await session.commit()
+    invalidate_user(tg_id)
+    return result.rowcount > 0
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import signal
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DRAIN_TIMEOUT = 30
+
+# Типы апдейтов, у которых есть чат; для остальных очередь строится по пользователю
+_CHAT_EVENTS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                "my_chat_member", "chat_member", "chat_join_request")
+_USER_EVENTS = ("callback_query", "inline_query", "chosen_inline_result",
+                "shipping_query", "pre_checkout_query", "poll_answer")
+
+
+def routing_key(update: Dict[str, Any]) -> int:
+    """Ключ упорядочивания апдейта: id чата или пользователя (сырой JSON из Telegram)"""
+    for name in _CHAT_EVENTS:
+        if name in update:
+            return update[name]["chat"]["id"]
+    for name in _USER_EVENTS:
+        if name in update:
+            event = update[name]
+            message = event.get("message")
+            if message:  # callback из сообщения — тот же ключ, что и у сообщений этого чата
+                return message["chat"]["id"]
+            user = event.get("from") or event.get("user")
+            if user:
+                return user["id"]
+    return update.get("update_id", 0)
+
+
+class ChatOrderedExecutor:
+    """
+    Параллельная обработка апдейтов с ограничением concurrency.
+    Апдейты одного чата выполняются строго по очереди, разные чаты — параллельно.
+    Исключение — сообщения одного альбома: они запускаются сразу друг за другом,
+    чтобы AlbumMiddleware дождался и склеил их, а следующий апдейт чата
+    (например, «Готово» после загрузки медиа) ждёт, пока альбом обработается.
+    """
+
+    def __init__(self, process: Callable[[Dict[str, Any]], Awaitable[Any]], concurrency: int = WEBHOOK_CONCURRENCY):
+        self.process = process
+        self.accepting = True
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues: Dict[Any, Deque[Dict[str, Any]]] = {}
+        self._arrived: Dict[Any, asyncio.Event] = {}
+        self._tasks: set = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.pending = 0
+        self.processed = 0
+        self.failed = 0
+
+    def submit(self, key: Any, update: Dict[str, Any]):
+        self.pending += 1
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            self._arrived[key].set()
+            return
+        self._queues[key] = deque([update])
+        self._arrived[key] = asyncio.Event()
+        self._idle.clear()
+        task = asyncio.create_task(self._run_chat(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, update: Dict[str, Any]):
+        async with self._semaphore:
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Ошибка обработки апдейта %s", update.get("update_id"))
+        self.pending -= 1
+
+    async def _run_chat(self, key: Any):
+        queue, arrived = self._queues[key], self._arrived[key]
+        album, members = None, []  # текущий альбом и задачи его сообщений
+        try:
+            while queue or members:
+                if not queue:
+                    # очередь пуста, альбом ещё обрабатывается: ждём его конца или новый апдейт чата
+                    arrived.clear()
+                    waiter = asyncio.create_task(arrived.wait())
+                    await asyncio.wait([waiter, *members], return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    members = [task for task in members if not task.done()]
+                    continue
+                update = queue.popleft()
+                group = update.get("message", {}).get("media_group_id")
+                if members and group != album:
+                    await asyncio.gather(*members)
+                    members = []
+                if group:
+                    album = group
+                    members.append(asyncio.create_task(self._process(update)))
+                else:
+                    await self._process(update)
+        finally:
+            del self._queues[key]
+            del self._arrived[key]
+            if not self._queues:
+                self._idle.set()
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """Перестать принимать апдейты и дождаться обработки уже принятых"""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s апдейтов при остановке", self.pending)
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self.pending,
+            "active_chats": len(self._queues),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+def create_app(
+    executor: ChatOrderedExecutor,
+    path: str = WEBHOOK_PATH,
+    secret: str = WEBHOOK_SECRET,
+    max_pending: int = WEBHOOK_MAX_PENDING,
+) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=401)
+        if not executor.accepting:
+            return web.Response(status=503)
+        if executor.pending >= max_pending:
+            return web.Response(status=429)  # Telegram повторит доставку позже
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        executor.submit(routing_key(update), update)
+        return web.Response()
+
+    async def handle_health(request: web.Request) -> web.Response:
+        return web.json_response(executor.stats())
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", handle_health)
+    return app
+
+
+async def serve(executor: ChatOrderedExecutor, on_started: Optional[Callable[[], Awaitable[Any]]] = None):
+    """Поднять aiohttp‑сервер и работать до SIGINT/SIGTERM, затем аккуратно остановиться"""
+    runner = web.AppRunner(create_app(executor))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logging.info("Webhook‑сервер слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        if on_started:
+            await on_started()
+        await stop.wait()
+    finally:
+        await executor.drain()
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    executor = ChatOrderedExecutor(lambda update: dp.feed_raw_update(bot, update))
+
+    async def register_webhook():
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await serve(executor, on_started=register_webhook)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()